@@ -0,0 +1,114 @@
+"""
+Benchmark the KNearestNeighbor search backends against the no-loops path.
+
+Uses CIFAR-10 from cs231n/datasets if it has been downloaded, and random
+clustered data of the same shape otherwise. Run from the assignment1
+directory:
+
+  python benchmark_knn.py --num-train 20000 --num-test 1000 -k 10
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from cs231n.classifiers import KNearestNeighbor
+from cs231n.data_utils import load_CIFAR10
+
+
+def load_data(num_train, num_test, seed=0):
+  cifar10_dir = 'cs231n/datasets/cifar-10-batches-py'
+  if os.path.isdir(cifar10_dir):
+    X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir)
+    X_train = X_train[:num_train].reshape(num_train, -1)
+    X_test = X_test[:num_test].reshape(num_test, -1)
+    return X_train, y_train[:num_train], X_test, 'CIFAR-10'
+
+  # Gaussian blobs in pixel space, so that approximate search has some
+  # structure to exploit.
+  rng = np.random.RandomState(seed)
+  centers = rng.uniform(0, 255, size=(50, 3072))
+  y_train = rng.randint(0, 50, num_train)
+  X_train = centers[y_train] + 40 * rng.randn(num_train, 3072)
+  X_test = centers[rng.randint(0, 50, num_test)] + 40 * rng.randn(num_test, 3072)
+  return X_train, y_train % 10, X_test, 'synthetic'
+
+
+def recall(neighbors, exact):
+  hits = [np.intersect1d(a, b).size for a, b in zip(neighbors, exact)]
+  return float(np.sum(hits)) / exact.size
+
+
+def timed(fn):
+  start = time.time()
+  out = fn()
+  return out, time.time() - start
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--num-train', type=int, default=20000)
+  parser.add_argument('--num-test', type=int, default=1000)
+  parser.add_argument('-k', type=int, default=10)
+  parser.add_argument('--low-dim', type=int, default=16,
+                      help='dimension of the projected features used for the k-d tree')
+  args = parser.parse_args()
+  k = args.k
+
+  X_train, y_train, X_test, source = load_data(args.num_train, args.num_test)
+  print('%s: %d train, %d test, D = %d, k = %d' % (
+        source, X_train.shape[0], X_test.shape[0], X_train.shape[1], k))
+
+  knn = KNearestNeighbor()
+  knn.train(X_train, y_train)
+  dists, base_time = timed(lambda: knn.compute_distances_no_loops(X_test))
+  exact = np.argsort(dists, axis=1)[:, :k]
+  y_exact = knn.predict_labels(dists, k=k)
+  del dists
+  print('%-28s %8.3fs' % ('no loops', base_time))
+
+  (_, neighbors), t = timed(lambda: knn.compute_neighbors_blocked(X_test, k))
+  print('%-28s %8.3fs  speedup %5.2fx  recall %.3f' % (
+        'blocked', t, base_time / t, recall(neighbors, exact)))
+
+  knn32 = KNearestNeighbor(precision='float32')
+  knn32.train(X_train, y_train)
+  (_, neighbors), t32 = timed(lambda: knn32.compute_neighbors_blocked(X_test, k))
+  agree = np.mean(knn32.predict_labels_from_neighbors(neighbors) == y_exact)
+  print('%-28s %8.3fs  speedup %5.2fx  recall %.3f  labels %.3f  (vs blocked %.2fx)' % (
+        'blocked float32 + rerank', t32, base_time / t32,
+        recall(neighbors, exact), agree, t / t32))
+  del knn32
+
+  n_lists = int(np.sqrt(X_train.shape[0]))
+  for n_probe in [1, 2, 4, 8, 16, 32]:
+    if n_probe > n_lists:
+      break
+    _, build_time = timed(lambda: knn.train(X_train, y_train, index='ivf',
+                                            n_lists=n_lists, n_probe=n_probe))
+    (_, neighbors), t = timed(lambda: knn.index.search(X_test, k))
+    agree = np.mean(knn.predict_labels_from_neighbors(neighbors) == y_exact)
+    print('%-28s %8.3fs  speedup %5.2fx  recall %.3f  labels %.3f  (build %.1fs)' % (
+          'ivf n_probe=%d/%d' % (n_probe, n_lists), t, base_time / t,
+          recall(neighbors, exact), agree, build_time))
+
+  # The k-d tree only pays off on low-dimensional features, so compare it on
+  # a random projection of the data rather than on raw pixels.
+  proj = np.random.RandomState(0).randn(X_train.shape[1], args.low_dim)
+  F_train, F_test = X_train.dot(proj), X_test.dot(proj)
+  knn.train(F_train, y_train)
+  dists, low_time = timed(lambda: knn.compute_distances_no_loops(F_test))
+  exact = np.argsort(dists, axis=1)[:, :k]
+  del dists
+  _, build_time = timed(lambda: knn.train(F_train, y_train, index='kdtree'))
+  (_, neighbors), t = timed(lambda: knn.index.search(F_test, k))
+  print('%-28s %8.3fs  speedup %5.2fx  recall %.3f  (build %.1fs, no loops %.3fs)' % (
+        'kdtree D=%d' % args.low_dim, t, low_time / t,
+        recall(neighbors, exact), build_time, low_time))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,100 @@
+"""
+Check that the fast KNearestNeighbor paths agree with the plain no-loops path.
+
+Every check builds small random data, with many tied distances so that the
+tie-breaking is exercised as well, and fails with an AssertionError if a fast
+path disagrees. Run from the assignment1 directory:
+
+  python check_knn.py
+"""
+from __future__ import print_function
+
+import numpy as np
+
+from cs231n.classifiers import KNearestNeighbor
+from cs231n.classifiers.k_nearest_neighbor import cross_validate_k
+
+
+def tied_data(num_train=500, num_test=200, dim=4, seed=0):
+  """
+  Return small integer-valued data, whose distances are exact and often tied.
+  """
+  rng = np.random.RandomState(seed)
+  X_train = rng.randint(0, 3, size=(num_train, dim)).astype(np.float64)
+  y_train = rng.randint(0, 5, size=num_train)
+  X_test = rng.randint(0, 3, size=(num_test, dim)).astype(np.float64)
+  return X_train, y_train, X_test
+
+
+def check_blocked_matches_unblocked():
+  X_train, y_train, X_test = tied_data()
+  knn = KNearestNeighbor()
+  knn.train(X_train, y_train)
+  for k in (1, 5, 20):
+    expected = knn.predict(X_test, k=k)
+    _, reference = knn.compute_neighbors_blocked(X_test, k, 10 ** 9)
+    for memory_budget in (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6):
+      y_pred = knn.predict(X_test, k=k, memory_budget=memory_budget)
+      assert np.array_equal(y_pred, expected), (k, memory_budget)
+      _, neighbors = knn.compute_neighbors_blocked(X_test, k, memory_budget)
+      assert np.array_equal(neighbors, reference), (k, memory_budget)
+
+
+def check_empty_test_set():
+  X_train, y_train, X_test = tied_data()
+  knn = KNearestNeighbor()
+  knn.train(X_train, y_train)
+  assert knn.predict(X_test[:0], k=3).shape == (0,)
+  assert knn.predict(X_test[:0], k=3, memory_budget=10 ** 6).shape == (0,)
+
+
+def check_parallel_matches_serial():
+  X_train, y_train, X_test = tied_data()
+  knn = KNearestNeighbor()
+  knn.train(X_train, y_train)
+  for num_test in (0, 3, 200):
+    expected = knn.predict(X_test[:num_test], k=3)
+    for backend in ('thread', 'process'):
+      y_pred = knn.predict(X_test[:num_test], k=3, n_jobs=8, backend=backend)
+      assert np.array_equal(y_pred, expected), (num_test, backend)
+
+
+def check_cross_validate_k():
+  X, y, _ = tied_data(num_train=300)
+  k_choices = [1, 3, 8]
+  num_folds = 4
+  folds = np.array_split(np.arange(X.shape[0]), num_folds)
+  for memory_budget in (10 ** 3, 10 ** 5, 10 ** 8):
+    k_to_accuracies = cross_validate_k(X, y, k_choices, num_folds,
+                                       memory_budget=memory_budget)
+    for i, fold in enumerate(folds):
+      train = np.concatenate(folds[:i] + folds[i + 1:])
+      knn = KNearestNeighbor()
+      knn.train(X[train], y[train])
+      for k in k_choices:
+        accuracy = np.mean(knn.predict(X[fold], k=k) == y[fold])
+        assert k_to_accuracies[k][i] == accuracy, (memory_budget, i, k)
+  try:
+    cross_validate_k(X, y, [226], num_folds)
+  except ValueError:
+    pass
+  else:
+    raise AssertionError('k larger than the training folds was accepted')
+
+
+CHECKS = [
+  check_blocked_matches_unblocked,
+  check_empty_test_set,
+  check_parallel_matches_serial,
+  check_cross_validate_k,
+]
+
+
+def main():
+  for check in CHECKS:
+    check()
+    print('ok  %s' % check.__name__)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,28 +1,147 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
 import numpy as np
 from past.builtins import xrange
 
+from cs231n.classifiers.knn_index import *
+from cs231n.classifiers.knn_index import _block_sizes, _merge_topk, _smallest_k
+
+
+def majority_vote(codes, num_classes):
+    """
+    Majority vote for many test points at once.
+
+    Inputs:
+    - codes: Integer array of shape (num_test, k) where codes[i] lists the
+      label codes (0 <= c < num_classes) of the neighbors of the ith test point,
+      sorted by increasing distance.
+    - num_classes: Number of distinct label codes.
+
+    Returns:
+    - winners: Array of shape (num_test,) with the most frequent code of every
+      row; ties go to the code that occurs first in the row, i.e. the one with
+      the nearest neighbor.
+    """
+    num_test, k = codes.shape
+    rows = np.repeat(np.arange(num_test), k)
+    flat = rows * num_classes + codes.ravel()
+    counts = np.bincount(flat, minlength=num_test * num_classes)
+    first = np.full(num_test * num_classes, k)
+    np.minimum.at(first, flat, np.tile(np.arange(k), num_test))
+    # A count difference of one outweighs any difference in position
+    score = counts * (k + 1) - first
+    return np.argmax(score.reshape(num_test, num_classes), axis=1)
+
+
+def _share_arrays(arrays):
+    """
+    Copy arrays into shared memory blocks so worker processes can map them
+    instead of receiving a pickled copy each.
+
+    Returns a tuple of:
+    - blocks: List of SharedMemory objects; the caller must close and unlink
+      them once the workers are done.
+    - specs: List of (name, shape, dtype) tuples to pass to _attach_arrays.
+    """
+    blocks, specs = [], []
+    for a in arrays:
+        block = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+        np.ndarray(a.shape, dtype=a.dtype, buffer=block.buf)[...] = a
+        blocks.append(block)
+        specs.append((block.name, a.shape, a.dtype.str))
+    return blocks, specs
+
+
+def _attach_arrays(specs):
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=block.buf)
+              for block, (_, shape, dtype) in zip(blocks, specs)]
+    return blocks, arrays
+
+
+def _predict_shard_shared(specs, X, k, memory_budget, num_classes,
+                          num_candidates):
+    """
+    Worker for KNearestNeighbor.predict(backend='process'): search and vote
+    for one shard of test points against training data in shared memory.
+    Returns label codes.
+    """
+    blocks, arrays = _attach_arrays(specs)
+    X_train, train_sq_norms, y_train_codes = arrays[:3]
+    if num_candidates is None:
+        _, neighbors = blocked_kneighbors(X, X_train, train_sq_norms, k,
+                                          memory_budget)
+    else:
+        X_train_low, low_sq_norms = arrays[3:]
+        _, neighbors = reranked_kneighbors(X, X_train, train_sq_norms,
+                                           X_train_low, low_sq_norms, k,
+                                           num_candidates, memory_budget)
+        del X_train_low, low_sq_norms
+    winners = majority_vote(y_train_codes[neighbors], num_classes)
+    # The views must be gone before the shared memory can be closed
+    del arrays, X_train, train_sq_norms, y_train_codes
+    for block in blocks:
+        block.close()
+    return winners
+
 
 class KNearestNeighbor(object):
     """ a kNN classifier with L2 distance """
 
-    def __init__(self):
-        pass
+    def __init__(self, precision='float64', rerank=8):
+        """
+        Inputs:
+        - precision: 'float64' computes all distances in double precision.
+          'float32' searches a single precision copy of the training data,
+          halving the bytes moved by the distance matrix products, and then
+          re-ranks the best candidates of every test point in double
+          precision. Only used by the blocked engine.
+        - rerank: With precision 'float32', the number of candidates re-ranked
+          per test point beyond the k that are returned.
+        """
+        if precision not in ('float64', 'float32'):
+            raise ValueError('Invalid precision "%s"' % precision)
+        self.precision = precision
+        self.rerank = rerank
 
-    def train(self, X, y):
+    def train(self, X, y, index=None, **index_params):
         """
         Train the classifier. For k-nearest neighbors this is just
-        memorizing the training data.
+        memorizing the training data, and optionally building a search index.
 
         Inputs:
         - X: A numpy array of shape (num_train, D) containing the training data
           consisting of num_train samples each of dimension D.
         - y: A numpy array of shape (N,) containing the training labels, where
              y[i] is the label for X[i].
+        - index: If not None, a string naming a search index in knn_index.py
+          ('kdtree' for exact search on low-dimensional features, 'ivf' for
+          approximate search on raw pixels) that predict() will use instead of
+          brute force.
+        - index_params: Extra keyword arguments passed to the index, such as
+          n_lists and n_probe for 'ivf'.
         """
         self.X_train = X
         self.y_train = y
+        # Voting works on dense label codes 0, ..., num_classes - 1
+        self.classes, self.y_train_codes = np.unique(y, return_inverse=True)
+        # Cached for the blocked distance engine, which would otherwise
+        # recompute them for every block of test points.
+        self.train_sq_norms = np.sum(np.square(X), axis=1)
+        if self.precision == 'float32':
+            self.X_train_low = X.astype(np.float32)
+            self.low_sq_norms = np.sum(np.square(self.X_train_low), axis=1)
+
+        self.index = None
+        if index is not None:
+            if index not in INDEXES:
+                raise ValueError('Invalid index "%s"' % index)
+            self.index = INDEXES[index](X, **index_params)
 
-    def predict(self, X, k=1, num_loops=0):
+    def predict(self, X, k=1, num_loops=0, memory_budget=None, n_jobs=1,
+                backend='thread'):
         """
         Predict labels for test data using this classifier.
 
@@ -32,11 +151,33 @@ class KNearestNeighbor(object):
         - k: The number of nearest neighbors that vote for the predicted labels.
         - num_loops: Determines which implementation to use to compute distances
           between training points and testing points.
+        - memory_budget: If not None, ignore num_loops and use the blocked
+          distance engine (see compute_neighbors_blocked) with tiles of
+          roughly this many bytes, so the full distance matrix is never built.
+
+        - n_jobs: Number of workers the test points are split across; -1 uses
+          one per CPU. With n_jobs != 1 distances are always computed with
+          the blocked engine (or the index, if any), never as a full matrix.
+        - backend: 'thread' or 'process'. Threads share the training data
+          directly; processes map it from shared memory instead of receiving
+          a pickled copy. The 'process' backend does not support indexes.
+
+        If an index was built by train(), num_loops and memory_budget are
+        ignored and the index is searched instead.
 
         Returns:
         - y: A numpy array of shape (num_test,) containing predicted labels for the
           test data, where y[i] is the predicted label for the test point X[i].
         """
+        if n_jobs != 1:
+            return self._predict_parallel(X, k, memory_budget, n_jobs, backend)
+        if self.index is not None:
+            _, neighbors = self.index.search(X, k)
+            return self.predict_labels_from_neighbors(neighbors)
+        if memory_budget is not None:
+            _, neighbors = self.compute_neighbors_blocked(X, k, memory_budget)
+            return self.predict_labels_from_neighbors(neighbors)
+
         if num_loops == 0:
             dists = self.compute_distances_no_loops(X)
         elif num_loops == 1:
@@ -48,6 +189,56 @@ class KNearestNeighbor(object):
 
         return self.predict_labels(dists, k=k)
 
+    def _predict_parallel(self, X, k, memory_budget, n_jobs, backend):
+        """
+        Split the test points into n_jobs contiguous shards, search and vote
+        for every shard in a worker, and concatenate the results in order.
+        """
+        if n_jobs < 0:
+            n_jobs = os.cpu_count() or 1
+        # Every shard needs at least one test point
+        n_jobs = max(min(n_jobs, X.shape[0]), 1)
+        if memory_budget is None:
+            memory_budget = DEFAULT_MEMORY_BUDGET // n_jobs
+        bounds = np.linspace(0, X.shape[0], n_jobs + 1).astype(int)
+        shards = [X[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+        if backend == 'thread':
+            def predict_shard(X_shard):
+                if self.index is not None:
+                    _, neighbors = self.index.search(X_shard, k)
+                else:
+                    _, neighbors = self.compute_neighbors_blocked(
+                        X_shard, k, memory_budget)
+                return self._vote(neighbors)
+            with ThreadPoolExecutor(n_jobs) as pool:
+                return np.concatenate(list(pool.map(predict_shard, shards)))
+
+        if backend != 'process':
+            raise ValueError('Invalid backend "%s"' % backend)
+        if self.index is not None:
+            raise ValueError('The process backend does not support indexes')
+        arrays = [np.ascontiguousarray(self.X_train), self.train_sq_norms,
+                  self.y_train_codes]
+        num_candidates = None
+        if self.precision == 'float32':
+            arrays += [self.X_train_low, self.low_sq_norms]
+            num_candidates = k + self.rerank
+        blocks, specs = _share_arrays(arrays)
+        try:
+            num_classes = self.classes.shape[0]
+            with ProcessPoolExecutor(n_jobs) as pool:
+                futures = [pool.submit(_predict_shard_shared, specs, X_shard, k,
+                                       memory_budget, num_classes,
+                                       num_candidates)
+                           for X_shard in shards]
+                winners = np.concatenate([f.result() for f in futures])
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+        return self.classes[winners]
+
     def compute_distances_two_loops(self, X):
         """
         Compute the distance between each test point in X and each training point
@@ -130,6 +321,58 @@ class KNearestNeighbor(object):
         #########################################################################
         return dists
 
+    def compute_neighbors_blocked(self, X, k=1,
+                                  memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        Find the k nearest training points of each test point in X by
+        streaming over blocks of test and training points, keeping peak memory
+        around memory_budget bytes regardless of num_test and num_train.
+        With precision 'float32' the search runs in single precision and the
+        best k + rerank candidates are re-ranked in double precision.
+
+        Inputs:
+        - X: A numpy array of shape (num_test, D) containing test data.
+        - k: The number of nearest neighbors to find.
+        - memory_budget: Approximate number of bytes used per block.
+
+        Returns a tuple of:
+        - dists: A numpy array of shape (num_test, k) where dists[i, j] is the
+          distance from the ith test point to its jth nearest neighbor.
+        - neighbors: A numpy array of shape (num_test, k) where neighbors[i, j]
+          is the index in self.X_train of the jth nearest neighbor of the ith
+          test point.
+        """
+        if self.precision == 'float32':
+            return reranked_kneighbors(X, self.X_train, self.train_sq_norms,
+                                       self.X_train_low, self.low_sq_norms, k,
+                                       k + self.rerank, memory_budget)
+        return blocked_kneighbors(X, self.X_train, self.train_sq_norms, k,
+                                  memory_budget)
+
+    def predict_labels_from_neighbors(self, neighbors):
+        """
+        Given the indices of the nearest training points of every test point,
+        sorted by increasing distance, predict a label for each test point.
+        Ties are broken the same way as in predict_labels.
+
+        Inputs:
+        - neighbors: A numpy array of shape (num_test, k) where neighbors[i, j]
+          is the index of the jth nearest training point to the ith test point.
+
+        Returns:
+        - y: A numpy array of shape (num_test,) containing predicted labels for the
+          test data, where y[i] is the predicted label for the test point X[i].
+        """
+        return self._vote(neighbors)
+
+    def _vote(self, neighbors):
+        """
+        Majority vote over the labels of sorted neighbor lists; see
+        majority_vote.
+        """
+        codes = self.y_train_codes[neighbors]
+        return self.classes[majority_vote(codes, self.classes.shape[0])]
+
     def predict_labels(self, dists, k=1):
         """
         Given a matrix of distances between test points and training points,
@@ -143,30 +386,82 @@ class KNearestNeighbor(object):
         - y: A numpy array of shape (num_test,) containing predicted labels for the
           test data, where y[i] is the predicted label for the test point X[i].
         """
-        num_test = dists.shape[0]
-        y_pred = np.zeros(num_test)
-        for i in xrange(num_test):
-            # A list of length k storing the labels of the k nearest neighbors to
-            # the ith test point.
-            #########################################################################
-            # Use the distance matrix to find the k nearest neighbors of the ith    #
-            # testing point, and use self.y_train to find the labels of these       #
-            # neighbors. Store these labels in closest_y.                           #
-            # Hint: Look up the function numpy.argsort.                             #
-            #########################################################################
-            closest_y = self.y_train[np.argsort(dists[i])[0:k]]
-            pass
-            #########################################################################
-            # Now that you have found the labels of the k nearest neighbors, you    #
-            # need to find the most common label in the list closest_y of labels.   #
-            # Store this label in y_pred[i]. Break ties by choosing the smaller     #
-            # label.                                                                #
-            #########################################################################
-            unique_elements, ind, frequency = np.unique(closest_y, return_index=True, return_counts=True)
-            y_pred[i] = unique_elements[np.lexsort((ind, -frequency))][0]
-            pass
-            #########################################################################
-            #                           END OF YOUR CODE                            #
-            #########################################################################
+        # Only the k smallest distances of each row matter, so select them with
+        # a partial sort across all rows at once and then order just those k;
+        # ties go to the smaller training index, as in the blocked engine.
+        k = min(k, dists.shape[1])
+        part = _smallest_k(dists, np.arange(dists.shape[1]), k)
+        order = np.lexsort((part, np.take_along_axis(dists, part, axis=1)), axis=1)
+        return self._vote(np.take_along_axis(part, order, axis=1))
+
+
+def cross_validate_k(X, y, k_choices, num_folds=5,
+                     memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Run num_folds-fold cross-validation of KNearestNeighbor for every k in
+    k_choices at the cost of roughly one distance computation.
+
+    The data is split into contiguous folds, as with np.array_split. The
+    distances between every pair of folds are computed once, in tiles of
+    both folds sized from memory_budget, and used for both folds of the
+    pair; each point keeps a single sorted list of its max(k_choices) nearest
+    neighbors among the other folds, and every k is evaluated by voting over
+    a prefix of that list.
+
+    Inputs:
+    - X: A numpy array of shape (N, D) containing the data.
+    - y: A numpy array of shape (N,) containing the labels.
+    - k_choices: A list of values of k to evaluate; each must be at most the
+      number of points outside the largest fold.
+    - num_folds: The number of folds.
+    - memory_budget: Approximate number of bytes used per block of distances.
+
+    Returns:
+    - k_to_accuracies: A dictionary mapping every k in k_choices to an array of
+      shape (num_folds,) where k_to_accuracies[k][i] is the accuracy on fold i
+      when training on all other folds.
+    """
+    N = X.shape[0]
+    classes, codes = np.unique(y, return_inverse=True)
+    # Same fold sizes as np.array_split
+    sizes = [len(fold) for fold in np.array_split(np.arange(N), num_folds)]
+    bounds = np.concatenate(([0], np.cumsum(sizes)))
+    max_k = max(k_choices)
+    if max_k > N - max(sizes):
+        raise ValueError('k = %d is larger than the %d training points of the '
+                         'largest fold' % (max_k, N - max(sizes)))
+    sq_norms = np.sum(np.square(X), axis=1)
+
+    # Running top-k of every fold, padded with infinite distances
+    best_d = [np.full((n, max_k), np.inf) for n in sizes]
+    best_i = [np.full((n, max_k), -1, dtype=np.intp) for n in sizes]
+    for i in xrange(num_folds):
+        for j in xrange(i + 1, num_folds):
+            a, b = bounds[i], bounds[i + 1]
+            c, e = bounds[j], bounds[j + 1]
+            row_block, col_block = _block_sizes(b - a, e - c, max_k,
+                                                X.dtype.itemsize, memory_budget)
+            for r in xrange(a, b, row_block):
+                r_end = min(r + row_block, b)
+                rows = slice(r - a, r_end - a)
+                for s in xrange(c, e, col_block):
+                    s_end = min(s + col_block, e)
+                    cols = slice(s - c, s_end - c)
+                    d = X[r:r_end].dot(X[s:s_end].T)
+                    d *= -2
+                    d += sq_norms[s:s_end]
+                    d += sq_norms[r:r_end, np.newaxis]
+                    best_d[i][rows], best_i[i][rows] = _merge_topk(
+                        best_d[i][rows], best_i[i][rows], d, s, max_k)
+                    best_d[j][cols], best_i[j][cols] = _merge_topk(
+                        best_d[j][cols], best_i[j][cols], d.T, r, max_k)
 
-        return y_pred
+    k_to_accuracies = {k: np.zeros(num_folds) for k in k_choices}
+    for i in xrange(num_folds):
+        order = np.lexsort((best_i[i], best_d[i]), axis=1)
+        neighbor_codes = codes[np.take_along_axis(best_i[i], order, axis=1)]
+        fold_codes = codes[bounds[i]:bounds[i + 1]]
+        for k in k_choices:
+            winners = majority_vote(neighbor_codes[:, :k], classes.shape[0])
+            k_to_accuracies[k][i] = np.mean(winners == fold_codes)
+    return k_to_accuracies
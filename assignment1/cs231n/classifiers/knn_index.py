@@ -0,0 +1,354 @@
+import numpy as np
+from past.builtins import xrange
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+"""
+Nearest neighbor search backends for KNearestNeighbor.
+
+Every index is built from the training data once, at train() time, and has
+the same interface:
+
+def search(self, X, k):
+
+Inputs:
+  - X: A numpy array of shape (num_test, D) containing test data.
+  - k: The number of nearest neighbors to find.
+
+Returns a tuple of:
+  - dists: Array of shape (num_test, k) giving the L2 distance from each test
+    point to its neighbors, in increasing order.
+  - neighbors: Integer array of shape (num_test, k) giving the indices of those
+    neighbors in the training data.
+
+Exact indexes always return the true nearest neighbors; approximate indexes
+trade some recall for speed.
+"""
+
+# Default number of bytes a single block of the blocked engine may use
+DEFAULT_MEMORY_BUDGET = 64 * 2 ** 20
+
+# Smallest number of test rows we are willing to process per block when
+# sizing blocks from a memory budget; below this the matrix products get too
+# skinny to make good use of BLAS.
+_MIN_TEST_BLOCK = 64
+
+
+def _block_sizes(num_test, num_train, k, itemsize, memory_budget):
+    """
+    Choose (test_block, train_block) sizes for the blocked distance engine so
+    that the working set of a single block stays within memory_budget bytes.
+
+    For every (test row, candidate) cell of a block we hold a distance and a
+    merged distance of the given itemsize, plus two index arrays.
+    """
+    bytes_per_cell = 2 * itemsize + 2 * np.dtype(np.intp).itemsize
+    max_cells = max(int(memory_budget) // bytes_per_cell, 1)
+    train_block = max(min(num_train, max_cells // _MIN_TEST_BLOCK - k), 1)
+    test_block = max(min(num_test, max_cells // (train_block + k)), 1)
+    return test_block, train_block
+
+
+def _smallest_k(d, idx, k):
+    """
+    Select the k smallest entries of every row of d, breaking ties by the
+    smaller index, so that the selection does not depend on the order in
+    which the candidates are presented.
+
+    Inputs:
+    - d: Array of shape (B, C) of distances, C >= k.
+    - idx: Integer array of shape (B, C), or broadcastable to it, giving the
+      index that breaks ties between equal entries of d.
+    - k: Number of entries to select.
+
+    Returns:
+    - part: Integer array of shape (B, k) of the selected positions in every
+      row of d; unsorted.
+    """
+    part = np.argpartition(d, k - 1, axis=1)[:, :k]
+    # argpartition picks arbitrarily among entries equal to the kth smallest;
+    # the rare rows with such ties are selected by a full sort instead.
+    kth = np.max(np.take_along_axis(d, part, axis=1), axis=1, keepdims=True)
+    tied = np.flatnonzero(np.count_nonzero(d <= kth, axis=1) > k)
+    if tied.size > 0:
+        idx = np.broadcast_to(idx, d.shape)
+        part[tied] = np.lexsort((idx[tied], d[tied]), axis=1)[:, :k]
+    return part
+
+
+def _merge_topk(best_d, best_i, d, offset, k):
+    """
+    Merge a block of squared distances into a running top-k.
+
+    Inputs:
+    - best_d, best_i: Arrays of shape (B, m), m <= k, holding the smallest
+      squared distances seen so far and their training indices.
+    - d: Array of shape (B, T) of squared distances to training points
+      offset, ..., offset + T - 1.
+    - offset: Index of the first training point covered by d.
+    - k: Number of neighbors to keep.
+
+    Returns a tuple of:
+    - best_d, best_i: Arrays of shape (B, min(k, m + T)); unsorted. Ties are
+      broken by the smaller training index, so the result does not depend on
+      how the training points are split into blocks.
+    """
+    B, T = d.shape
+    cand_d = np.concatenate((best_d, d), axis=1)
+    cand_i = np.concatenate(
+        (best_i, np.broadcast_to(np.arange(offset, offset + T), (B, T))), axis=1)
+    if cand_d.shape[1] <= k:
+        return cand_d, cand_i
+    part = _smallest_k(cand_d, cand_i, k)
+    return (np.take_along_axis(cand_d, part, axis=1),
+            np.take_along_axis(cand_i, part, axis=1))
+
+
+def blocked_kneighbors(X, X_train, train_sq_norms, k, memory_budget):
+    """
+    Find the k nearest training points of every test point without ever
+    materializing the full (num_test, num_train) distance matrix.
+
+    Test and training points are processed in tiles whose size is chosen from
+    memory_budget; for each tile of test points we stream over tiles of
+    training points and only keep a running top-k, so peak memory depends on
+    the tile size rather than on num_test * num_train.
+
+    Inputs:
+    - X: A numpy array of shape (num_test, D) containing test data.
+    - X_train: A numpy array of shape (num_train, D) containing training data.
+    - train_sq_norms: A numpy array of shape (num_train,) giving the squared
+      L2 norm of every row of X_train.
+    - k: Number of neighbors to find; clipped to num_train.
+    - memory_budget: Approximate number of bytes a single tile may use.
+
+    Returns a tuple of:
+    - dists: Array of shape (num_test, k) giving the L2 distance from each
+      test point to its neighbors, in increasing order.
+    - neighbors: Integer array of shape (num_test, k) giving the indices of
+      those neighbors in X_train; of two training points at the same
+      distance, the one with the smaller index comes first.
+    """
+    num_test = X.shape[0]
+    num_train = X_train.shape[0]
+    k = min(k, num_train)
+    dtype = np.result_type(X, X_train)
+    test_block, train_block = _block_sizes(num_test, num_train, k,
+                                           dtype.itemsize, memory_budget)
+
+    dists = np.empty((num_test, k), dtype=dtype)
+    neighbors = np.empty((num_test, k), dtype=np.intp)
+    for i in xrange(0, num_test, test_block):
+        X_block = X[i:i + test_block]
+        test_sq_norms = np.sum(np.square(X_block), axis=1)[:, np.newaxis]
+        best_d = np.empty((X_block.shape[0], 0), dtype=dtype)
+        best_i = np.empty((X_block.shape[0], 0), dtype=np.intp)
+        for j in xrange(0, num_train, train_block):
+            d = X_block.dot(X_train[j:j + train_block].T)
+            d *= -2
+            d += train_sq_norms[j:j + train_block]
+            d += test_sq_norms
+            best_d, best_i = _merge_topk(best_d, best_i, d, j, k)
+
+        # Sort the surviving neighbors by distance, breaking ties by index.
+        order = np.lexsort((best_i, best_d), axis=1)
+        best_d = np.take_along_axis(best_d, order, axis=1)
+        dists[i:i + test_block] = np.sqrt(np.maximum(best_d, 0))
+        neighbors[i:i + test_block] = np.take_along_axis(best_i, order, axis=1)
+
+    return dists, neighbors
+
+
+def reranked_kneighbors(X, X_train, train_sq_norms, X_train_low, low_sq_norms,
+                        k, num_candidates, memory_budget):
+    """
+    Find the k nearest training points of every test point by searching in
+    reduced precision and re-ranking in full precision.
+
+    The blocked engine first finds num_candidates candidates per test point
+    using X_train_low, typically a float32 copy of X_train that moves half
+    the bytes; only those candidates are then re-ranked with distances
+    computed from X_train. The result matches blocked_kneighbors on X_train
+    unless a true neighbor falls outside the reduced-precision candidates.
+
+    Inputs:
+    - X, X_train, train_sq_norms, k, memory_budget: As for blocked_kneighbors.
+    - X_train_low: Array of shape (num_train, D); X_train in reduced precision.
+    - low_sq_norms: Array of shape (num_train,); squared norms of X_train_low.
+    - num_candidates: Number of candidates re-ranked per test point; at
+      least k.
+
+    Returns: Same as blocked_kneighbors.
+    """
+    num_test, D = X.shape
+    num_train = X_train.shape[0]
+    k = min(k, num_train)
+    num_candidates = min(max(num_candidates, k), num_train)
+    _, candidates = blocked_kneighbors(X.astype(X_train_low.dtype), X_train_low,
+                                       low_sq_norms, num_candidates,
+                                       memory_budget)
+
+    # Re-rank in blocks small enough for the gathered candidate rows to fit in
+    # the memory budget.
+    dtype = np.result_type(X, X_train)
+    block = max(int(memory_budget) // (num_candidates * D * dtype.itemsize), 1)
+    dists = np.empty((num_test, k), dtype=dtype)
+    neighbors = np.empty((num_test, k), dtype=np.intp)
+    for i in xrange(0, num_test, block):
+        X_block = X[i:i + block].astype(dtype)
+        cand = candidates[i:i + block]
+        d = np.einsum('bd,bcd->bc', X_block, X_train[cand])
+        d *= -2
+        d += train_sq_norms[cand]
+        d += np.sum(np.square(X_block), axis=1)[:, np.newaxis]
+        order = np.lexsort((cand, d), axis=1)[:, :k]
+        best_d = np.take_along_axis(d, order, axis=1)
+        dists[i:i + block] = np.sqrt(np.maximum(best_d, 0))
+        neighbors[i:i + block] = np.take_along_axis(cand, order, axis=1)
+
+    return dists, neighbors
+
+
+class KDTreeIndex(object):
+    """
+    Exact search with a k-d tree. Works well for low-dimensional features such
+    as the HOG + color histogram output of features.extract_features, but
+    degrades to brute force for raw pixels.
+    """
+
+    def __init__(self, X_train, leafsize=16):
+        """
+        Inputs:
+        - X_train: A numpy array of shape (num_train, D) of training data.
+        - leafsize: Number of points at which the tree switches to brute force.
+        """
+        self.tree = cKDTree(X_train, leafsize=leafsize)
+
+    def search(self, X, k):
+        k = min(k, self.tree.n)
+        dists, neighbors = self.tree.query(X, k=k)
+        if k == 1:
+            dists, neighbors = dists[:, np.newaxis], neighbors[:, np.newaxis]
+        return dists, neighbors.astype(np.intp)
+
+
+class IVFIndex(object):
+    """
+    Approximate search with an inverted file: the training points are split
+    into n_lists clusters by k-means, and a query is only compared against
+    the points of its n_probe closest clusters. n_probe is the recall-vs-speed
+    knob; with n_probe = n_lists the search is exact.
+    """
+
+    def __init__(self, X_train, n_lists=None, n_probe=8, num_iters=10,
+                 num_samples=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                 seed=0):
+        """
+        Inputs:
+        - X_train: A numpy array of shape (num_train, D) of training data.
+        - n_lists: Number of clusters; defaults to sqrt(num_train).
+        - n_probe: Number of clusters searched per query.
+        - num_iters: Number of k-means iterations used to find the clusters.
+        - num_samples: Number of training points k-means is run on; defaults
+          to 64 points per cluster.
+        - memory_budget: Approximate number of bytes per block used when
+          assigning points to clusters and when falling back to brute force.
+        - seed: Seed for the random initialization of k-means.
+        """
+        num_train = X_train.shape[0]
+        if n_lists is None:
+            n_lists = int(np.sqrt(num_train))
+        n_lists = max(1, min(n_lists, num_train))
+        if num_samples is None:
+            num_samples = 64 * n_lists
+        self.n_probe = n_probe
+        self.memory_budget = memory_budget
+        self.X_train = X_train
+        self.train_sq_norms = np.sum(np.square(X_train), axis=1)
+
+        # Run k-means on a subsample of the training points
+        rng = np.random.RandomState(seed)
+        sample = X_train[rng.choice(num_train, min(num_samples, num_train),
+                                    replace=False)]
+        centroids = sample[rng.choice(sample.shape[0], n_lists, replace=False)]
+        for _ in xrange(num_iters):
+            assign = self._assign(sample, centroids)
+            counts = np.bincount(assign, minlength=n_lists)
+            nonempty = counts > 0
+            members = csr_matrix((np.ones(assign.size), (assign, np.arange(assign.size))),
+                                 shape=(n_lists, assign.size))
+            sums = np.asarray(members.dot(sample))
+            centroids = centroids.copy()
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, np.newaxis]
+            # Re-seed empty clusters with random sample points
+            empty = np.flatnonzero(~nonempty)
+            centroids[empty] = sample[rng.choice(sample.shape[0], empty.size)]
+        self.centroids = centroids
+        self.centroid_sq_norms = np.sum(np.square(centroids), axis=1)
+
+        # Store the training points grouped by cluster so that every inverted
+        # list is a contiguous block of self.X_sorted.
+        assign = self._assign(X_train, centroids)
+        self.perm = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=n_lists)
+        self.list_ends = np.cumsum(counts)
+        self.list_starts = self.list_ends - counts
+        self.X_sorted = X_train[self.perm]
+        self.sorted_sq_norms = self.train_sq_norms[self.perm]
+
+    def _assign(self, X, centroids):
+        norms = np.sum(np.square(centroids), axis=1)
+        _, nearest = blocked_kneighbors(X, centroids, norms, 1,
+                                        self.memory_budget)
+        return nearest[:, 0]
+
+    def search(self, X, k):
+        num_test = X.shape[0]
+        n_lists = self.centroids.shape[0]
+        k = min(k, self.X_train.shape[0])
+        n_probe = min(self.n_probe, n_lists)
+        _, probes = blocked_kneighbors(X, self.centroids,
+                                       self.centroid_sq_norms, n_probe,
+                                       self.memory_budget)
+        test_sq_norms = np.sum(np.square(X), axis=1)
+
+        best_d = np.full((num_test, k), np.inf)
+        best_i = np.full((num_test, k), -1, dtype=np.intp)
+        # Visit every inverted list once, together with all queries probing it
+        probe_lists = probes.ravel()
+        probe_rows = np.repeat(np.arange(num_test), n_probe)
+        order = np.argsort(probe_lists, kind='stable')
+        bounds = np.searchsorted(probe_lists[order], np.arange(n_lists + 1))
+        for l in xrange(n_lists):
+            start, end = self.list_starts[l], self.list_ends[l]
+            rows = probe_rows[order[bounds[l]:bounds[l + 1]]]
+            if rows.size == 0 or start == end:
+                continue
+            d = X[rows].dot(self.X_sorted[start:end].T)
+            d *= -2
+            d += self.sorted_sq_norms[start:end]
+            d += test_sq_norms[rows, np.newaxis]
+            best_d[rows], best_i[rows] = _merge_topk(best_d[rows], best_i[rows],
+                                                     d, start, k)
+
+        order = np.lexsort((best_i, best_d), axis=1)
+        best_d = np.take_along_axis(best_d, order, axis=1)
+        best_i = np.take_along_axis(best_i, order, axis=1)
+        dists = np.sqrt(np.maximum(best_d, 0))
+        neighbors = self.perm[best_i]
+
+        # Queries whose probed lists hold fewer than k points fall back to an
+        # exact search.
+        short = np.flatnonzero(best_i[:, -1] < 0)
+        if short.size > 0:
+            dists[short], neighbors[short] = blocked_kneighbors(
+                X[short], self.X_train, self.train_sq_norms, k,
+                self.memory_budget)
+        return dists, neighbors
+
+
+# Map the names accepted by KNearestNeighbor.train to index classes
+INDEXES = {
+    'kdtree': KDTreeIndex,
+    'ivf': IVFIndex,
+}
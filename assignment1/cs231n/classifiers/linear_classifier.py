@@ -6,13 +6,54 @@ from cs231n.classifiers.softmax import *
 from past.builtins import xrange
 
 
+def minibatches(X, y, batch_size, sampling='replacement'):
+    """
+    Return an endless iterator over minibatches (X_batch, y_batch) of X and y.
+
+    Inputs:
+    - X: A numpy array of shape (N, ...) containing training data.
+    - y: A numpy array of shape (N,) containing training labels.
+    - batch_size: (integer) number of training examples per minibatch.
+    - sampling: (string) how minibatches are drawn:
+      'replacement': every minibatch is drawn independently, with replacement.
+      'epoch': every epoch walks contiguous slices of a fresh random
+        permutation, so it visits every example once; the last
+        N % batch_size examples of each permutation are skipped.
+      'sequential': walk the data in order; minibatches are contiguous,
+        zero-copy slices of X and y, which suits data that is already
+        shuffled.
+    """
+    if sampling not in ('replacement', 'epoch', 'sequential'):
+        raise ValueError('Invalid sampling "%s"' % sampling)
+    num_train = X.shape[0]
+    batches_per_epoch = max(num_train // batch_size, 1)
+
+    def generate():
+        while True:
+            if sampling == 'replacement':
+                ind = np.random.choice(num_train, batch_size)
+                yield X[ind], y[ind]
+                continue
+            if sampling == 'epoch':
+                order = np.random.permutation(num_train)
+            for i in xrange(batches_per_epoch):
+                start, end = i * batch_size, (i + 1) * batch_size
+                if sampling == 'epoch':
+                    ind = order[start:end]
+                    yield X[ind], y[ind]
+                else:
+                    yield X[start:end], y[start:end]
+
+    return generate()
+
+
 class LinearClassifier(object):
 
     def __init__(self):
         self.W = None
 
     def train(self, X, y, learning_rate=1e-3, reg=1e-5, num_iters=100,
-              batch_size=200, verbose=False):
+              batch_size=200, verbose=False, sampling='replacement'):
         """
         Train this linear classifier using stochastic gradient descent.
 
@@ -26,6 +67,8 @@ class LinearClassifier(object):
         - num_iters: (integer) number of steps to take when optimizing
         - batch_size: (integer) number of training examples to use at each step.
         - verbose: (boolean) If true, print progress during optimization.
+        - sampling: (string) how minibatches are drawn: 'replacement',
+          'epoch' or 'sequential'; see minibatches.
 
         Outputs:
         A list containing the value of the loss function at each training iteration.
@@ -38,6 +81,7 @@ class LinearClassifier(object):
 
         # Run stochastic gradient descent to optimize W
         loss_history = []
+        batches = minibatches(X, y, batch_size, sampling)
         for it in xrange(num_iters):
             X_batch = None
             y_batch = None
@@ -52,9 +96,7 @@ class LinearClassifier(object):
             # Hint: Use np.random.choice to generate indices. Sampling with         #
             # replacement is faster than sampling without replacement.              #
             #########################################################################
-            ind = np.random.choice(num_train, batch_size)
-            X_batch = X[ind]
-            y_batch = y[ind]
+            X_batch, y_batch = next(batches)
             pass
             #########################################################################
             #                       END OF YOUR CODE                                #
@@ -3,6 +3,7 @@ from __future__ import print_function
 import numpy as np
 import matplotlib.pyplot as plt
 from past.builtins import xrange
+from cs231n.classifiers.linear_classifier import minibatches
 
 
 class TwoLayerNet(object):
@@ -130,7 +131,7 @@ class TwoLayerNet(object):
     def train(self, X, y, X_val, y_val,
               learning_rate=1e-3, learning_rate_decay=0.95,
               reg=5e-6, num_iters=100,
-              batch_size=200, verbose=False):
+              batch_size=200, verbose=False, sampling='replacement'):
         """
         Train this neural network using stochastic gradient descent.
 
@@ -147,6 +148,8 @@ class TwoLayerNet(object):
         - num_iters: Number of steps to take when optimizing.
         - batch_size: Number of training examples to use per step.
         - verbose: boolean; if true print progress during optimization.
+        - sampling: How minibatches are drawn: 'replacement', 'epoch' or
+          'sequential'; see linear_classifier.minibatches.
         """
         num_train = X.shape[0]
         iterations_per_epoch = max(num_train / batch_size, 1)
@@ -156,6 +159,7 @@ class TwoLayerNet(object):
         train_acc_history = []
         val_acc_history = []
 
+        batches = minibatches(X, y, batch_size, sampling)
         for it in xrange(num_iters):
             X_batch = None
             y_batch = None
@@ -164,9 +168,7 @@ class TwoLayerNet(object):
             # Create a random minibatch of training data and labels, storing        #
             # them in X_batch and y_batch respectively.                             #
             #########################################################################
-            ind = np.random.choice(num_train, batch_size)
-            X_batch = X[ind]
-            y_batch = y[ind]
+            X_batch, y_batch = next(batches)
             pass
             #########################################################################
             #                             END OF YOUR CODE                          #
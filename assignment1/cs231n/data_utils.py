@@ -7,6 +7,8 @@ import os
 from imageio import imread # replace with this
 import platform
 
+from cs231n.file_utils import atomic_path
+
 def load_pickle(f):
     version = platform.python_version_tuple()
     if version[0] == '2':
@@ -15,29 +17,90 @@ def load_pickle(f):
         return  pickle.load(f, encoding='latin1')
     raise ValueError("invalid python version: {}".format(version))
 
-def load_CIFAR_batch(filename):
+def load_CIFAR_batch(filename, dtype="float"):
   """ load single batch of cifar """
   with open(filename, 'rb') as f:
     datadict = load_pickle(f)
     X = datadict['data']
     Y = datadict['labels']
-    X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype("float")
+    X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype(dtype)
     Y = np.array(Y)
     return X, Y
 
-def load_CIFAR10(ROOT):
-  """ load all of cifar """
+def cache_CIFAR10(ROOT, cache_dir=None):
+  """
+  Convert the pickled CIFAR-10 batches in ROOT, once, into uint8 .npy files
+  that can be memory-mapped. Images are stored both as NHWC and as NCHW so
+  neither layout needs a transpose on load.
+
+  Inputs:
+  - ROOT: Directory holding the cifar-10-batches-py files.
+  - cache_dir: Directory for the .npy files; defaults to ROOT/npy_cache.
+
+  Returns:
+  - cache_dir: The directory holding X_{train,test}_{nhwc,nchw}.npy and
+    y_{train,test}.npy.
+  """
+  if cache_dir is None:
+    cache_dir = os.path.join(ROOT, 'npy_cache')
+  names = ['X_train_nhwc', 'X_train_nchw', 'y_train',
+           'X_test_nhwc', 'X_test_nchw', 'y_test']
+  paths = [os.path.join(cache_dir, name + '.npy') for name in names]
+  if all(os.path.isfile(path) for path in paths):
+    return cache_dir
+  if not os.path.isdir(cache_dir):
+    os.makedirs(cache_dir)
+
+  Xtr, Ytr, Xte, Yte = load_CIFAR10(ROOT, dtype=np.uint8)
+  arrays = [Xtr, Xtr.transpose(0, 3, 1, 2), Ytr,
+            Xte, Xte.transpose(0, 3, 1, 2), Yte]
+  for path, a in zip(paths, arrays):
+    with atomic_path(path) as tmp_path:
+      with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(a))
+  return cache_dir
+
+def load_CIFAR10(ROOT, dtype="float", mmap_mode=None, layout='NHWC',
+                 cache_dir=None):
+  """
+  load all of cifar
+
+  By default the pickled batches are decoded and cast to dtype on every
+  call. If mmap_mode is given (e.g. 'r'), the uint8 cache written by
+  cache_CIFAR10 is memory-mapped instead, building it on first use; loading
+  is then near-instant and all processes share one copy in the page cache.
+
+  Inputs:
+  - ROOT: Directory holding the cifar-10-batches-py files.
+  - dtype: Datatype of the returned images when not memory-mapping.
+  - mmap_mode: None, or a np.load mmap_mode for the uint8 cache.
+  - layout: 'NHWC' or 'NCHW'; layout of the memory-mapped images.
+  - cache_dir: Cache directory for cache_CIFAR10.
+
+  Returns a tuple of X_train, y_train, X_test, y_test.
+  """
+  if mmap_mode is not None:
+    if layout not in ('NHWC', 'NCHW'):
+      raise ValueError('Invalid layout "%s"' % layout)
+    cache_dir = cache_CIFAR10(ROOT, cache_dir)
+    def load(name):
+      return np.load(os.path.join(cache_dir, name + '.npy'),
+                     mmap_mode=mmap_mode)
+    suffix = layout.lower()
+    return (load('X_train_' + suffix), load('y_train'),
+            load('X_test_' + suffix), load('y_test'))
+
   xs = []
   ys = []
   for b in range(1,6):
     f = os.path.join(ROOT, 'data_batch_%d' % (b, ))
-    X, Y = load_CIFAR_batch(f)
+    X, Y = load_CIFAR_batch(f, dtype)
     xs.append(X)
     ys.append(Y)    
   Xtr = np.concatenate(xs)
   Ytr = np.concatenate(ys)
   del X, Y
-  Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'))
+  Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'), dtype)
   return Xtr, Ytr, Xte, Yte
 
 
@@ -0,0 +1,201 @@
+from __future__ import print_function
+
+import functools
+import hashlib
+import os
+
+import numpy as np
+
+from cs231n.features import extract_features
+from cs231n.file_utils import atomic_path
+
+
+def fingerprint_feature_fn(feature_fn):
+  """
+  Describe a feature function by a string that changes whenever its
+  configuration does.
+
+  The fingerprint covers the function's name, bytecode, constants, default
+  arguments and closure, the values of any scalar globals it reads (so a
+  lambda such as lambda img: color_histogram_hsv(img, nbin=num_color_bins)
+  changes fingerprint with num_color_bins), and the arguments bound by
+  functools.partial. Changes to the code of functions it calls are not
+  detected; use FeatureCache.invalidate after editing those.
+  """
+  if isinstance(feature_fn, functools.partial):
+    keywords = sorted((feature_fn.keywords or {}).items())
+    return 'partial(%s, %r, %r)' % (fingerprint_feature_fn(feature_fn.func),
+                                    feature_fn.args, keywords)
+
+  parts = [getattr(feature_fn, '__module__', None),
+           getattr(feature_fn, '__qualname__', repr(feature_fn))]
+  code = getattr(feature_fn, '__code__', None)
+  if code is not None:
+    parts.append(_fingerprint_code(code))
+    parts.append(repr(feature_fn.__defaults__))
+    parts.append(repr(feature_fn.__kwdefaults__))
+    closure = feature_fn.__closure__ or ()
+    parts.append(repr([_scalar_repr(cell.cell_contents) for cell in closure]))
+    scalars = [(name, _scalar_repr(feature_fn.__globals__[name]))
+               for name in code.co_names if name in feature_fn.__globals__]
+    parts.append(repr([(name, value) for name, value in scalars
+                       if value is not None]))
+  return '|'.join(str(part) for part in parts)
+
+
+def _fingerprint_code(code):
+  consts = [_fingerprint_code(c) if hasattr(c, 'co_code') else repr(c)
+            for c in code.co_consts]
+  return hashlib.sha1(code.co_code + repr(consts).encode()).hexdigest()
+
+
+def _scalar_repr(value):
+  if isinstance(value, (bool, int, float, str, tuple)) or np.isscalar(value):
+    return repr(value)
+  return None
+
+
+def hash_array(a, chunk_bytes=64 * 2 ** 20):
+  """
+  Hash the shape, dtype and contents of an array, reading it in chunks so that
+  non-contiguous or memory-mapped arrays are never copied as a whole.
+  """
+  h = hashlib.sha1(repr((a.shape, a.dtype.str)).encode())
+  if a.ndim == 0 or a.shape[0] == 0:
+    h.update(np.ascontiguousarray(a).tobytes())
+    return h.hexdigest()
+  rows = max(1, chunk_bytes // max(a[0].nbytes, 1))
+  for start in range(0, a.shape[0], rows):
+    h.update(np.ascontiguousarray(a[start:start + rows]).data)
+  return h.hexdigest()
+
+
+class FeatureCache(object):
+  """
+  A persistent store of extracted feature matrices.
+
+  Every feature matrix is saved as a .npy file named by a hash of the input
+  images and the fingerprints of the feature functions, and is returned as a
+  read-only memory map, so repeated runs of a notebook skip the extraction
+  and only page in the features they touch.
+
+  Example usage:
+
+  cache = FeatureCache('cs231n/datasets/feature_cache', max_bytes=2 * 2 ** 30)
+  X_train_feats = cache.extract_features(X_train, feature_fns, n_jobs=4)
+  """
+
+  def __init__(self, cache_dir, max_bytes=None, verbose=False):
+    """
+    Inputs:
+    - cache_dir: Directory the feature files are kept in; created if needed.
+    - max_bytes: If not None, the least recently used files are evicted
+      whenever the cache grows beyond this many bytes.
+    - verbose: Boolean; if true, print cache hits, misses and evictions.
+    """
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self.verbose = verbose
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+
+  def key(self, imgs, feature_fns, dtype=np.float64):
+    """
+    Return the cache key of the features of imgs under feature_fns.
+    """
+    h = hashlib.sha1(hash_array(imgs).encode())
+    for feature_fn in feature_fns:
+      h.update(fingerprint_feature_fn(feature_fn).encode())
+    h.update(np.dtype(dtype).str.encode())
+    return h.hexdigest()
+
+  def _path(self, key):
+    return os.path.join(self.cache_dir, key + '.npy')
+
+  def get(self, key):
+    """
+    Return the cached features for key as a read-only memory map, or None.
+    """
+    path = self._path(key)
+    if not os.path.isfile(path):
+      return None
+    os.utime(path, None)  # mark as recently used
+    return np.load(path, mmap_mode='r')
+
+  def extract_features(self, imgs, feature_fns, dtype=np.float64, **kwargs):
+    """
+    Return the features of imgs under feature_fns, computing them with
+    features.extract_features and storing them if they are not cached yet.
+
+    Inputs:
+    - imgs, feature_fns, dtype: As for features.extract_features.
+    - kwargs: Other keyword arguments for features.extract_features, such as
+      n_jobs and verbose; they do not affect the cache key.
+
+    Returns:
+    A read-only memory map of shape (N, F_1 + ... + F_k).
+    """
+    key = self.key(imgs, feature_fns, dtype)
+    feats = self.get(key)
+    if feats is not None:
+      if self.verbose:
+        print('Loaded cached features %s' % key)
+      return feats
+    if self.verbose:
+      print('Extracting features %s' % key)
+
+    # Find the feature dimension, then let extract_features write straight
+    # into a memory-mapped file that is only moved into place once complete.
+    num_features = sum(fn(imgs[0].squeeze()).size for fn in feature_fns)
+    path = self._path(key)
+    with atomic_path(path) as tmp_path:
+      out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype,
+                                      shape=(imgs.shape[0], num_features))
+      extract_features(imgs, feature_fns, out=out, **kwargs)
+      out.flush()
+      del out
+    self.evict(keep=key)
+    return np.load(path, mmap_mode='r')
+
+  def invalidate(self, key=None):
+    """
+    Remove the cached features for key, or every cached file if key is None.
+    """
+    if key is not None:
+      paths = [self._path(key)]
+    else:
+      paths = [os.path.join(self.cache_dir, f)
+               for f in os.listdir(self.cache_dir) if f.endswith('.npy')]
+    for path in paths:
+      if os.path.isfile(path):
+        os.remove(path)
+
+  def size(self):
+    """
+    Return the total number of bytes of all cached files.
+    """
+    return sum(os.path.getsize(os.path.join(self.cache_dir, f))
+               for f in os.listdir(self.cache_dir) if f.endswith('.npy'))
+
+  def evict(self, keep=None):
+    """
+    Remove least recently used files until the cache fits in max_bytes,
+    never removing the file for key keep.
+    """
+    if self.max_bytes is None:
+      return
+    entries = []
+    for f in os.listdir(self.cache_dir):
+      if f.endswith('.npy'):
+        st = os.stat(os.path.join(self.cache_dir, f))
+        entries.append((st.st_mtime, st.st_size, f))
+    total = sum(size for _, size, _ in entries)
+    for _, size, f in sorted(entries):
+      if total <= self.max_bytes:
+        break
+      if keep is not None and f == keep + '.npy':
+        continue
+      if self.verbose:
+        print('Evicting cached features %s' % f[:-len('.npy')])
+      os.remove(os.path.join(self.cache_dir, f))
+      total -= size
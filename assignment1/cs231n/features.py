@@ -1,24 +1,46 @@
 from __future__ import print_function
 from past.builtins import xrange
 
+import functools
+import multiprocessing
+import time
+
 import matplotlib
 import numpy as np
 from scipy.ndimage import uniform_filter
 
 
-def extract_features(imgs, feature_fns, verbose=False):
+def extract_features(imgs, feature_fns, verbose=False, n_jobs=1,
+                     chunk_size=1000, dtype=np.float64, out=None,
+                     timings=None):
   """
   Given pixel data for images and several feature functions that can operate on
   single images, apply all feature functions to all images, concatenating the
   feature vectors for each image and storing the features for all images in
   a single matrix.
 
+  Images are processed in chunks of chunk_size. A feature function may declare
+  a batched form by setting a batch_fn attribute to a function that takes an
+  N x H x W x C array and returns an N x F_i array (as hog_feature does); it
+  is then called once per chunk instead of once per image. This also works
+  for functools.partial objects wrapping such a function, which is the
+  preferred way of passing options such as nbin.
+
   Inputs:
   - imgs: N x H X W X C array of pixel data for N images.
   - feature_fns: List of k feature functions. The ith feature function should
     take as input an H x W x D array and return a (one-dimensional) array of
     length F_i.
-  - verbose: Boolean; if true, print progress.
+  - verbose: Boolean; if true, print progress and time spent per function.
+  - n_jobs: Number of worker processes chunks are spread across. Workers are
+    forked, so feature functions do not need to be picklable.
+  - chunk_size: Number of images per chunk.
+  - dtype: Datatype of the output matrix, e.g. np.float32 to halve its size.
+    Ignored if out is given.
+  - out: Optional preallocated array of shape (N, F_1 + ... + F_k), such as a
+    np.memmap, that features are written into.
+  - timings: Optional list; it is extended with the number of seconds spent in
+    each feature function, summed over all workers.
 
   Returns:
   An array of shape (N, F_1 + ... + F_k) where each column is the concatenation
@@ -30,30 +52,112 @@ def extract_features(imgs, feature_fns, verbose=False):
 
   # Use the first image to determine feature dimensions
   feature_dims = []
-  first_image_features = []
   for feature_fn in feature_fns:
     feats = feature_fn(imgs[0].squeeze())
     assert len(feats.shape) == 1, 'Feature functions must be one-dimensional'
     feature_dims.append(feats.size)
-    first_image_features.append(feats)
 
   # Now that we know the dimensions of the features, we can allocate a single
   # big array to store all features as columns.
   total_feature_dim = sum(feature_dims)
-  imgs_features = np.zeros((num_images, total_feature_dim))
-  imgs_features[0] = np.hstack(first_image_features).T
+  if out is None:
+    out = np.zeros((num_images, total_feature_dim), dtype=dtype)
+  assert out.shape == (num_images, total_feature_dim), 'out has the wrong shape'
+
+  chunks = [(start, min(start + chunk_size, num_images))
+            for start in xrange(0, num_images, chunk_size)]
+  fn_times = np.zeros(len(feature_fns))
 
-  # Extract features for the rest of the images.
-  for i in xrange(1, num_images):
+  def store(start, end, chunk_feats, chunk_times):
     idx = 0
-    for feature_fn, feature_dim in zip(feature_fns, feature_dims):
-      next_idx = idx + feature_dim
-      imgs_features[i, idx:next_idx] = feature_fn(imgs[i].squeeze())
-      idx = next_idx
-    if verbose and i % 1000 == 0:
-      print('Done extracting features for %d / %d images' % (i, num_images))
+    for feats, feature_dim in zip(chunk_feats, feature_dims):
+      out[start:end, idx:idx + feature_dim] = feats
+      idx += feature_dim
+    fn_times[:] += chunk_times
+    if verbose:
+      print('Done extracting features for %d / %d images' % (end, num_images))
+
+  if n_jobs == 1:
+    for start, end in chunks:
+      store(start, end, *_extract_chunk(imgs, feature_fns, start, end))
+  else:
+    # Workers inherit the images and functions through fork instead of
+    # receiving pickled copies.
+    ctx = multiprocessing.get_context('fork')
+    pool = ctx.Pool(n_jobs, initializer=_init_extract_worker,
+                    initargs=(imgs, feature_fns))
+    try:
+      for start, end, chunk_feats, chunk_times in pool.imap_unordered(
+          _extract_worker_chunk, chunks):
+        store(start, end, chunk_feats, chunk_times)
+    finally:
+      pool.close()
+      pool.join()
+
+  if verbose:
+    for feature_fn, seconds in zip(feature_fns, fn_times):
+      print('%s: %.2fs' % (_feature_fn_name(feature_fn), seconds))
+  if timings is not None:
+    timings.extend(fn_times.tolist())
+
+  return out
+
+
+def _feature_fn_name(feature_fn):
+  if isinstance(feature_fn, functools.partial):
+    return _feature_fn_name(feature_fn.func)
+  return getattr(feature_fn, '__name__', repr(feature_fn))
 
-  return imgs_features
+
+def _batch_fn(feature_fn):
+  """
+  Return the batched form of a feature function, or None if it has none.
+  """
+  if isinstance(feature_fn, functools.partial):
+    batch_fn = _batch_fn(feature_fn.func)
+    if batch_fn is None:
+      return None
+    return functools.partial(batch_fn, *feature_fn.args, **feature_fn.keywords)
+  return getattr(feature_fn, 'batch_fn', None)
+
+
+def _extract_chunk(imgs, feature_fns, start, end):
+  """
+  Apply every feature function to imgs[start:end].
+
+  Returns a tuple of:
+  - chunk_feats: List with an (end - start) x F_i array per feature function
+  - chunk_times: Array with the seconds spent in each feature function
+  """
+  chunk = imgs[start:end]
+  chunk_feats = []
+  chunk_times = np.zeros(len(feature_fns))
+  for i, feature_fn in enumerate(feature_fns):
+    tic = time.time()
+    batch_fn = _batch_fn(feature_fn)
+    if batch_fn is not None:
+      batch = chunk[..., 0] if chunk.ndim == 4 and chunk.shape[-1] == 1 else chunk
+      chunk_feats.append(batch_fn(batch))
+    else:
+      chunk_feats.append(np.array([feature_fn(img.squeeze()) for img in chunk]))
+    chunk_times[i] = time.time() - tic
+  return chunk_feats, chunk_times
+
+
+_extract_worker_state = {}
+
+
+def _init_extract_worker(imgs, feature_fns):
+  _extract_worker_state['imgs'] = imgs
+  _extract_worker_state['feature_fns'] = feature_fns
+
+
+def _extract_worker_chunk(bounds):
+  start, end = bounds
+  chunk_feats, chunk_times = _extract_chunk(_extract_worker_state['imgs'],
+                                            _extract_worker_state['feature_fns'],
+                                            start, end)
+  return start, end, chunk_feats, chunk_times
 
 
 def rgb2gray(rgb):
@@ -123,6 +227,69 @@ def hog_feature(im):
   return orientation_histogram.ravel()
 
 
+def hog_feature_batch(imgs):
+  """Compute Histogram of Gradient (HOG) features for a stack of images
+
+    Vectorized equivalent of calling hog_feature on every image: gradients,
+    orientation binning and cell pooling are computed for the whole batch at
+    once, with a single digitize and a single bincount in place of the
+    per-orientation masks and filters.
+
+    Parameters:
+      imgs : N x H x W x C array of rgb images, or N x H x W array of
+        grayscale images
+
+    Returns:
+      feats: N x F array; feats[i] matches hog_feature(imgs[i])
+
+  """
+  # convert rgb to grayscale if needed
+  if imgs.ndim == 4:
+    images = rgb2gray(imgs)
+  else:
+    images = np.asarray(imgs, dtype=np.float64)
+
+  N, sx, sy = images.shape # batch and image size
+  orientations = 9 # number of gradient bins
+  cx, cy = (8, 8) # pixels per cell
+
+  gx = np.zeros(images.shape)
+  gy = np.zeros(images.shape)
+  gx[:, :, :-1] = np.diff(images, n=1, axis=2) # compute gradient on x-direction
+  gy[:, :-1, :] = np.diff(images, n=1, axis=1) # compute gradient on y-direction
+  grad_mag = np.sqrt(gx ** 2 + gy ** 2) # gradient magnitude
+  grad_ori = np.arctan2(gy, (gx + 1e-15)) * (180 / np.pi) + 90 # gradient orientation
+
+  n_cellsx = int(np.floor(sx / cx))  # number of cells in x
+  n_cellsy = int(np.floor(sy / cy))  # number of cells in y
+  # hog_feature only samples whole cells, so crop to them
+  grad_mag = grad_mag[:, :n_cellsx * cx, :n_cellsy * cy]
+  grad_ori = grad_ori[:, :n_cellsx * cx, :n_cellsy * cy]
+
+  # Bin i holds orientations in [20 * i, 20 * (i + 1)); like hog_feature,
+  # drop orientations of exactly 0 and of 180 or more.
+  edges = 180 / orientations * np.arange(1, orientations + 1)
+  bins = np.digitize(grad_ori, edges)
+  keep = (grad_ori > 0) & (bins < orientations)
+
+  # Flat index of (image, cell row, cell column, orientation) for every pixel
+  cell_rows = np.arange(n_cellsx * cx) // cx
+  cell_cols = np.arange(n_cellsy * cy) // cy
+  cells = cell_rows[:, np.newaxis] * n_cellsy + cell_cols
+  images_offset = np.arange(N)[:, np.newaxis, np.newaxis] * (n_cellsx * n_cellsy)
+  index = (images_offset + cells) * orientations + bins
+  hist = np.bincount(index[keep], weights=grad_mag[keep],
+                     minlength=N * n_cellsx * n_cellsy * orientations)
+  # uniform_filter in hog_feature averages over the cell
+  hist = hist.reshape(N, n_cellsx, n_cellsy, orientations) / (cx * cy)
+
+  # hog_feature transposes the cell grid of each orientation
+  return hist.transpose(0, 2, 1, 3).reshape(N, -1)
+
+
+hog_feature.batch_fn = hog_feature_batch
+
+
 def color_histogram_hsv(im, nbin=10, xmin=0, xmax=255, normalized=True):
   """
   Compute color histogram for an image using hue.
@@ -148,4 +315,61 @@ def color_histogram_hsv(im, nbin=10, xmin=0, xmax=255, normalized=True):
   return imhist
 
 
-pass
+def rgb_to_hue(rgb):
+  """
+  Compute only the hue channel of matplotlib.colors.rgb_to_hsv, with the same
+  arithmetic, for an array of RGB values in [0, 1] of any shape (..., 3).
+
+  Returns:
+    Array of shape rgb.shape[:-1] giving hue in [0, 1).
+  """
+  arr = np.asarray(rgb, dtype=np.promote_types(rgb.dtype, np.float32))
+  r, g, b = arr[..., 0], arr[..., 1], arr[..., 2]
+  # Elementwise max/min over the channels is much faster than reducing over a
+  # length-3 axis, and gives the same values.
+  arr_max = np.maximum(np.maximum(r, g), b)
+  delta = arr_max - np.minimum(np.minimum(r, g), b)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    # Later cases take precedence, as in rgb_to_hsv
+    hue = np.where(b == arr_max, 4. + (r - g) / delta,
+                   np.where(g == arr_max, 2. + (b - r) / delta,
+                            (g - b) / delta))
+  hue = np.where(delta > 0, hue, 0)
+  return (hue / 6.0) % 1.0
+
+
+def color_histogram_hsv_batch(imgs, nbin=10, xmin=0, xmax=255, normalized=True):
+  """
+  Compute hue histograms for a stack of images at once.
+
+  Vectorized equivalent of calling color_histogram_hsv on every image: only
+  the hue channel is computed, and all N histograms are built with a single
+  bincount over per-image offset bin indices.
+
+  Inputs:
+  - imgs: N x H x W x C array of pixel data for N RGB images.
+  - nbin, xmin, xmax, normalized: As for color_histogram_hsv.
+
+  Returns:
+    N x nbin array; row i matches color_histogram_hsv(imgs[i], ...).
+  """
+  N = imgs.shape[0]
+  bins = np.linspace(xmin, xmax, nbin+1)
+  hue = (rgb_to_hue(imgs / xmax) * xmax).reshape(N, -1)
+
+  # Same binning as np.histogram: half-open bins, the last one closed
+  idx = np.searchsorted(bins, hue, side='right') - 1
+  idx[hue == bins[-1]] = nbin - 1
+  valid = (hue >= bins[0]) & (hue <= bins[-1])
+  offsets = np.arange(N)[:, np.newaxis] * nbin
+  counts = np.bincount((idx + offsets)[valid], minlength=N * nbin)
+  counts = counts.reshape(N, nbin)
+
+  db = np.diff(bins)
+  if normalized:
+    with np.errstate(divide='ignore', invalid='ignore'):
+      return counts / db / counts.sum(axis=1, keepdims=True) * db
+  return counts * db
+
+
+color_histogram_hsv.batch_fn = color_histogram_hsv_batch
@@ -0,0 +1,33 @@
+from __future__ import print_function
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+  """
+  Yield a temporary path next to path to write a file to, and move the file
+  into place at path once the block completes. Readers, whether other
+  processes or a later run after an interruption, thus see either the old
+  file or the complete new one, never a partially written file. If the block
+  raises, the temporary file is removed instead.
+
+  The temporary name does not end in the extension of path, so that
+  directory scans for finished files skip it; write to it through an open
+  file, since np.save and np.savez append '.npy' and '.npz' to file names
+  that lack them.
+
+  Example usage:
+
+  with atomic_path('X_train.npy') as tmp_path:
+    with open(tmp_path, 'wb') as f:
+      np.save(f, X_train)
+  """
+  tmp_path = '%s.%d.tmp' % (path, os.getpid())
+  try:
+    yield tmp_path
+    os.replace(tmp_path, path)
+  except BaseException:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
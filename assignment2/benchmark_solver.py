@@ -0,0 +1,189 @@
+"""
+Benchmark the training throughput of Solver on in-memory, memory-mapped and
+chunk-file datasets, or, with --schedules, the time to reach a target
+validation accuracy on CIFAR-10 under different learning rate schedules.
+
+Random data of the shape of CIFAR-10 is written to a scratch directory, then
+a small fully-connected net is trained for a fixed number of iterations on
+every storage and sampling combination. Run from the assignment2 directory:
+
+    python benchmark_solver.py --num-train 20000 --iterations 200
+
+The datasets are read through the page cache, so unless --num-train is made
+larger than the free memory the memmap numbers show the cost of the access
+pattern and of the extra copies rather than that of the disk.
+
+The schedule benchmark trains a FullyConnectedNet on the CIFAR-10 data in
+cs231n/datasets with each schedule and reports the first epoch, and the
+training time up to it, at which the validation accuracy reached --target-acc:
+
+    python benchmark_solver.py --schedules --num-epochs 10 --target-acc 0.5
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from cs231n.classifiers.fc_net import FullyConnectedNet
+from cs231n.data_utils import ChunkedArray, get_CIFAR10_data, save_chunks
+from cs231n.lr_schedule import (CosineSchedule, OneCycleSchedule,
+                                PlateauSchedule, StepSchedule, WarmupSchedule)
+from cs231n.solver import Solver
+
+
+def make_data(scratch_dir, num_train, num_val, chunk_size, seed=0):
+    """
+    Write random uint8 images to scratch_dir and return the in-memory,
+    memmap and chunk-file versions of them.
+    """
+    rng = np.random.RandomState(seed)
+    num_classes = 10
+    X = rng.randint(0, 256, size=(num_train, 3, 32, 32)).astype(np.float32)
+    y = rng.randint(num_classes, size=num_train)
+    X_val = rng.randint(0, 256, size=(num_val, 3, 32, 32)).astype(np.float32)
+    y_val = rng.randint(num_classes, size=num_val)
+
+    path = os.path.join(scratch_dir, 'X_train.npy')
+    np.save(path, X)
+    X_mmap = np.load(path, mmap_mode='r')
+    X_chunks = ChunkedArray(save_chunks(X, os.path.join(scratch_dir, 'X_train'),
+                                        chunk_size))
+    return {
+        'in-memory': X,
+        'memmap': X_mmap,
+        'chunk files': X_chunks,
+    }, y, X_val, y_val
+
+
+def run(X_train, y_train, X_val, y_val, iterations, batch_size, **kwargs):
+    """
+    Train for the given number of iterations and return iterations per second.
+    """
+    np.random.seed(0)
+    model = FullyConnectedNet([100, 100], input_dim=3 * 32 * 32,
+                              weight_scale=1e-3, reg=0.0)
+    data = {'X_train': X_train, 'y_train': y_train,
+            'X_val': X_val, 'y_val': y_val}
+    num_epochs = float(iterations) * batch_size / X_train.shape[0]
+    solver = Solver(model, data, update_rule='sgd_momentum',
+                    optim_config={'learning_rate': 1e-4},
+                    batch_size=batch_size, num_epochs=int(np.ceil(num_epochs)),
+                    verbose=False, **kwargs)
+    start = time.time()
+    solver.train()
+    return len(solver.loss_history) / (time.time() - start)
+
+
+def time_to_accuracy(data, schedule, learning_rate, num_epochs, batch_size,
+                     target_acc):
+    """
+    Train with the given schedule and return the first epoch at which the
+    validation accuracy reached target_acc, or None, the training time up to
+    that epoch and the best validation accuracy.
+    """
+    np.random.seed(0)
+    model = FullyConnectedNet([100, 100], weight_scale=5e-2, reg=1e-3,
+                              use_batchnorm=True)
+    solver = Solver(model, data, update_rule='adam',
+                    optim_config={'learning_rate': learning_rate},
+                    lr_schedule=schedule, batch_size=batch_size,
+                    num_epochs=num_epochs, sampling='epoch', verbose=False)
+    start = time.time()
+    solver.train()
+    # Epochs take about equally long, so the time to an epoch is the share
+    # of the training time, without the accuracy checks, up to it.
+    train_time = time.time() - start - solver.eval_time
+    hits = [i for i, acc in enumerate(solver.val_acc_history)
+            if acc >= target_acc]
+    if not hits:
+        return None, None, solver.best_val_acc
+    epoch = hits[0]
+    return epoch, train_time * epoch / num_epochs, solver.best_val_acc
+
+
+def benchmark_schedules(args):
+    data = get_CIFAR10_data(num_training=args.num_train,
+                            num_validation=args.num_val, num_test=0)
+    data = {k: v for k, v in data.items() if k in
+            ('X_train', 'y_train', 'X_val', 'y_val')}
+    print('%d train, %d val, batch size %d, %d epochs, target val acc %.2f' % (
+          data['X_train'].shape[0], data['X_val'].shape[0], args.batch_size,
+          args.num_epochs, args.target_acc))
+
+    lr = args.learning_rate
+    configs = [
+        ('constant', None, lr),
+        ('step', StepSchedule(max(args.num_epochs // 3, 1), 0.3), lr),
+        ('cosine', CosineSchedule(), lr),
+        ('warmup + cosine', WarmupSchedule(CosineSchedule()), 3 * lr),
+        ('one-cycle', OneCycleSchedule(), 3 * lr),
+        ('plateau', PlateauSchedule(factor=0.3, patience=1), lr),
+    ]
+    for name, schedule, learning_rate in configs:
+        epoch, seconds, best = time_to_accuracy(
+            data, schedule, learning_rate, args.num_epochs, args.batch_size,
+            args.target_acc)
+        if epoch is None:
+            reached = 'not reached'
+        else:
+            reached = 'epoch %2d  %7.1fs' % (epoch, seconds)
+        print('%-16s lr %.1e  %-18s best val acc %.3f' % (
+              name, learning_rate, reached, best))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-train', type=int, default=20000)
+    parser.add_argument('--num-val', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--scratch-dir', default=None,
+                        help='directory for the data files; a temporary one by default')
+    parser.add_argument('--schedules', action='store_true',
+                        help='benchmark time to accuracy of lr schedules on CIFAR-10')
+    parser.add_argument('--num-epochs', type=int, default=10)
+    parser.add_argument('--learning-rate', type=float, default=1e-3)
+    parser.add_argument('--target-acc', type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.schedules:
+        benchmark_schedules(args)
+        return
+
+    scratch_dir = args.scratch_dir or tempfile.mkdtemp()
+    try:
+        datasets, y, X_val, y_val = make_data(scratch_dir, args.num_train,
+                                              args.num_val, args.chunk_size)
+        print('%d train, %d val, batch size %d, chunk size %d' % (
+              args.num_train, args.num_val, args.batch_size, args.chunk_size))
+
+        configs = [
+            ('in-memory', 'random', {}),
+            ('in-memory', 'epoch + prefetch', {'prefetch': 2}),
+            ('memmap', 'random', {}),
+            ('memmap', 'chunked', {'chunk_size': args.chunk_size}),
+            ('memmap', 'chunked + prefetch', {'chunk_size': args.chunk_size,
+                                              'prefetch': 2}),
+            ('chunk files', 'chunked', {}),
+            ('chunk files', 'chunked + prefetch', {'prefetch': 2}),
+        ]
+        base = None
+        for storage, sampling, kwargs in configs:
+            rate = run(datasets[storage], y, X_val, y_val, args.iterations,
+                       args.batch_size, **kwargs)
+            base = base or rate
+            print('%-12s %-20s %8.1f it/s  %5.2fx' % (storage, sampling, rate,
+                                                      rate / base))
+    finally:
+        if args.scratch_dir is None:
+            shutil.rmtree(scratch_dir)
+
+
+if __name__ == '__main__':
+    main()
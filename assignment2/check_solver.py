@@ -0,0 +1,138 @@
+"""
+Check that the faster or resumable Solver paths train exactly like the plain
+one.
+
+Every check trains a small FullyConnectedNet on random data and fails with an
+AssertionError if a path's loss history drifts from the reference run. Run
+from the assignment2 directory:
+
+    python check_solver.py
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from cs231n import optim
+from cs231n.classifiers.fc_net import FullyConnectedNet
+from cs231n.solver import Solver
+
+
+def random_data(num_train=400, num_val=100, seed=0):
+    """
+    Return a data dictionary of random CIFAR-10 shaped images and labels.
+    """
+    rng = np.random.RandomState(seed)
+    N = num_train + num_val
+    X = rng.randn(N, 3, 8, 8)
+    y = rng.randint(10, size=N)
+    return {'X_train': X[:num_train], 'y_train': y[:num_train],
+            'X_val': X[num_train:], 'y_val': y[num_train:]}
+
+
+def make_solver(solver_kwargs, seed=1, **model_kwargs):
+    """
+    Seed np.random and return a Solver of a new model on random_data.
+    """
+    np.random.seed(seed)
+    model = FullyConnectedNet([50, 40], input_dim=3 * 8 * 8, reg=0.01,
+                              weight_scale=5e-2, dtype=np.float64,
+                              **model_kwargs)
+    kwargs = dict(update_rule='adam', optim_config={'learning_rate': 1e-3},
+                  num_epochs=2, batch_size=50, verbose=False)
+    kwargs.update(solver_kwargs)
+    return Solver(model, random_data(), **kwargs)
+
+
+def train(solver_kwargs, seed=1, **model_kwargs):
+    """
+    Train a Solver made by make_solver and return it.
+    """
+    solver = make_solver(solver_kwargs, seed, **model_kwargs)
+    solver.train()
+    return solver
+
+
+def check_parallel_matches_serial():
+    serial = train({})
+    for num_workers in (2, 5):
+        parallel = train({'num_workers': num_workers})
+        # The workers sum the losses of their shards, so allow for rounding.
+        assert np.allclose(parallel.loss_history, serial.loss_history,
+                           rtol=1e-10, atol=0), num_workers
+        assert parallel.val_acc_history == serial.val_acc_history, num_workers
+
+
+def check_resume_matches_uninterrupted():
+    checkpoint_dir = tempfile.mkdtemp()
+    try:
+        # Dropout and the default sampling draw from np.random, the
+        # subsampled accuracy checks too; with eval_every the checkpoints
+        # fall in the middle of an epoch of the loader.
+        for extra_kwargs in ({'num_train_samples': 100},
+                             {'sampling': 'epoch', 'eval_every': 3},
+                             {'sampling': 'epoch', 'prefetch': 2},
+                             {'sampling': 'sequential', 'eval_every': 3},
+                             {'compute_dtype': np.float32,
+                              'loss_scale': 'dynamic'}):
+            kwargs = dict(extra_kwargs, num_epochs=4, checkpoint_format='npz',
+                          checkpoint_name=os.path.join(checkpoint_dir, 'ck'))
+            model_kwargs = {'use_batchnorm': True, 'dropout': 0.5}
+            full = train(kwargs, **model_kwargs)
+            for epoch in (1, 2, 3):
+                # The second seed shows that nothing comes from the model init
+                resumed = make_solver(kwargs, seed=2, **model_kwargs)
+                resumed.load_checkpoint(os.path.join(
+                    checkpoint_dir, 'ck_epoch_%d.npz' % epoch))
+                resumed.train()
+                where = (extra_kwargs, epoch)
+                assert resumed.loss_history == full.loss_history, where
+                assert resumed.val_acc_history == full.val_acc_history, where
+                assert resumed.best_val_acc == full.best_val_acc, where
+                # train() leaves the best parameters in the model
+                for p, w in full.model.params.items():
+                    assert np.array_equal(resumed.model.params[p], w), (
+                        where, p)
+    finally:
+        shutil.rmtree(checkpoint_dir)
+
+
+def check_inplace_rules_match_originals():
+    numexpr = optim.numexpr
+    try:
+        # Both the numexpr path, when it is installed, and the numpy one
+        for optim.numexpr in [numexpr, None]:
+            for rule in ('sgd_momentum', 'rmsprop', 'adam'):
+                rng = np.random.RandomState(0)
+                x = rng.randn(50, 40)
+                x_inplace = x.copy()
+                config, config_inplace = {}, {}
+                for _ in range(5):
+                    dx = rng.randn(50, 40)
+                    x, config = getattr(optim, rule)(x, dx, config)
+                    x_inplace, config_inplace = getattr(
+                        optim, rule + '_inplace')(x_inplace, dx, config_inplace)
+                assert np.allclose(x_inplace, x, rtol=0, atol=1e-12), (
+                    rule, optim.numexpr)
+    finally:
+        optim.numexpr = numexpr
+
+
+CHECKS = [
+    check_parallel_matches_serial,
+    check_resume_matches_uninterrupted,
+    check_inplace_rules_match_originals,
+]
+
+
+def main():
+    for check in CHECKS:
+        check()
+        print('ok  %s' % check.__name__)
+
+
+if __name__ == '__main__':
+    main()
@@ -33,10 +33,15 @@ class ThreeLayerConvNet(object):
           of weights.
         - reg: Scalar giving L2 regularization strength
         - dtype: numpy datatype to use for computation.
+
+        The attribute loss_scale, 1 by default, multiplies the gradients that
+        loss returns, but not the loss itself; a Solver training in reduced
+        precision raises it to keep small float16 gradients from underflowing.
         """
         self.params = {}
         self.reg = reg
         self.dtype = dtype
+        self.loss_scale = 1.0
 
         ############################################################################
         # Initialize weights and biases for the three-layer convolutional          #
@@ -74,6 +79,7 @@ class ThreeLayerConvNet(object):
 
         Input / output: Same API as TwoLayerNet in fc_net.py.
         """
+        X = X.astype(self.dtype, copy=False)
         W1, b1 = self.params['W1'], self.params['b1']
         W2, b2 = self.params['W2'], self.params['b2']
         W3, b3 = self.params['W3'], self.params['b3']
@@ -111,15 +117,44 @@ class ThreeLayerConvNet(object):
         ############################################################################
         loss, d = softmax_loss(scores, y)
         loss = loss + (np.sum(W1**2) + np.sum(W2**2) + np.sum(W3**2)) * self.reg
+        if self.loss_scale != 1:
+            d *= self.loss_scale
+        reg = self.reg * self.loss_scale
         d, grads['W3'], grads['b3'] = affine_backward(d, cache_a)
-        grads['W3'] += self.reg * W3
+        grads['W3'] += reg * W3
         d, grads['W2'], grads['b2'] = affine_relu_backward(d, cache_h)
-        grads['W2'] += self.reg * W2
+        grads['W2'] += reg * W2
         d, grads['W1'], grads['b1'] = conv_relu_pool_backward(d.reshape((X.shape[0], ) + self.conv_out_size), cache_c)
-        grads['W1'] += self.reg * W1
+        grads['W1'] += reg * W1
         pass
         ############################################################################
         #                             END OF YOUR CODE                             #
         ############################################################################
 
         return loss, grads
+
+
+    def inference(self, X):
+        """
+        Compute test-time class scores for X, equal to those of loss(X), but
+        dropping the cache of every layer, including the im2col buffers of the
+        convolution, as soon as the layer returns.
+
+        Input:
+        - X: Array of input data of shape (N, C, H, W)
+
+        Returns:
+        - scores: Array of shape (N, C) giving classification scores
+        """
+        X = X.astype(self.dtype, copy=False)
+        W1, b1 = self.params['W1'], self.params['b1']
+        W2, b2 = self.params['W2'], self.params['b2']
+        W3, b3 = self.params['W3'], self.params['b3']
+
+        filter_size = W1.shape[2]
+        conv_param = {'stride': 1, 'pad': (filter_size - 1) // 2}
+        pool_param = {'pool_height': 2, 'pool_width': 2, 'stride': 2}
+
+        out = conv_relu_pool_forward(X, W1, b1, conv_param, pool_param)[0]
+        out = affine_relu_forward(out, W2, b2)[0]
+        return affine_forward(out, W3, b3)[0]
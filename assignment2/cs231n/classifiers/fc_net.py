@@ -158,12 +158,17 @@ class FullyConnectedNet(object):
         - seed: If not None, then pass this random seed to the dropout layers. This
           will make the dropout layers deteriminstic so we can gradient check the
           model.
+
+        The attribute loss_scale, 1 by default, multiplies the gradients that
+        loss returns, but not the loss itself; a Solver training in reduced
+        precision raises it to keep small float16 gradients from underflowing.
         """
         self.use_batchnorm = use_batchnorm
         self.use_dropout = dropout > 0
         self.reg = reg
         self.num_layers = 1 + len(hidden_dims)
         self.dtype = dtype
+        self.loss_scale = 1.0
         self.params = {}
 
         ############################################################################
@@ -283,10 +288,13 @@ class FullyConnectedNet(object):
         # of 0.5 to simplify the expression for the gradient.                      #
         ############################################################################
         loss, d = softmax_loss(scores, y)
+        if self.loss_scale != 1:
+            d *= self.loss_scale
+        reg = self.reg * self.loss_scale
         for i in range(self.num_layers, 1, -1):
             loss += self.reg * np.sum(self.params[f'W{i}'] ** 2) / 2
             d, grads[f'W{i}'], grads[f'b{i}'] = affine_backward(d, cache[i])
-            grads[f'W{i}'] += self.params[f'W{i}'] * self.reg
+            grads[f'W{i}'] += self.params[f'W{i}'] * reg
             if self.use_dropout:
                 d = dropout_backward(d, cache_d[i-1])
             d = relu_backward(d, cache_r[i-1])
@@ -294,10 +302,42 @@ class FullyConnectedNet(object):
                 d, grads[f'gamma{i-1}'], grads[f'beta{i-1}'] = batchnorm_backward_alt(d, cache_b[i-1])
         loss += self.reg * np.sum(self.params['W1'] ** 2) / 2
         _, grads['W1'], grads['b1'] = affine_backward(d, cache[1])
-        grads['W1'] += self.params['W1'] * self.reg
+        grads['W1'] += self.params['W1'] * reg
         pass
         ############################################################################
         #                             END OF YOUR CODE                             #
         ############################################################################
 
         return loss, grads
+
+
+    def inference(self, X):
+        """
+        Compute test-time class scores for X, equal to those of loss(X), but
+        without building the caches that only the backward pass needs; every
+        activation is transformed in place and freed once the next layer has
+        consumed it.
+
+        Input:
+        - X: Array of input data of shape (N, d_1, ..., d_k)
+
+        Returns:
+        - scores: Array of shape (N, C) giving classification scores
+        """
+        h = X.reshape(X.shape[0], -1).astype(self.dtype)
+        for i in range(1, self.num_layers):
+            h = h.dot(self.params[f'W{i}'])
+            h += self.params[f'b{i}']
+            if self.use_batchnorm:
+                bn_param = self.bn_params[i-1]
+                D = h.shape[1]
+                running_mean = bn_param.get('running_mean', np.zeros(D, dtype=h.dtype))
+                running_var = bn_param.get('running_var', np.zeros(D, dtype=h.dtype))
+                eps = bn_param.get('eps', 1e-5)
+                h -= running_mean
+                h *= self.params[f'gamma{i}'] / np.sqrt(running_var + eps)
+                h += self.params[f'beta{i}']
+            np.maximum(h, 0, out=h)
+        scores = h.dot(self.params[f'W{self.num_layers}'])
+        scores += self.params[f'b{self.num_layers}']
+        return scores
@@ -0,0 +1,220 @@
+from __future__ import print_function, division
+from future import standard_library
+standard_library.install_aliases()
+from builtins import range
+from builtins import object
+import queue
+import threading
+
+import numpy as np
+
+
+class MinibatchLoader(object):
+    """
+    A MinibatchLoader streams shuffled minibatches of a dataset, one epoch
+    after another. Each epoch visits every example once in a fresh random
+    order; the N % batch_size examples left over are dropped for that epoch.
+
+    With prefetch > 0 the minibatches are gathered (and augmented) on a
+    background thread into a fixed set of reusable buffers and handed over
+    through a bounded queue, so the copy overlaps with the forward and
+    backward pass of the previous minibatch. numpy releases the GIL while it
+    copies, so a thread is enough and the dataset is shared without copies.
+
+    For datasets that live on disk, such as memmaps or ChunkedArrays, pass
+    chunk_size: each epoch then shuffles the order of the chunks of
+    chunk_size consecutive examples and the examples within every chunk, so
+    a minibatch reads from one or two chunks instead of from all over the
+    file, and the rows of every minibatch are read in increasing order.
+
+    With shuffle=False, prefetch=0 and no augment_fn the minibatches are
+    contiguous, zero-copy slices of X and y instead, which suits data that is
+    already shuffled.
+
+    A minibatch returned by next() lives in one of the reusable buffers, or
+    is a view of the data, and is only valid until the following call to
+    next(); copy it to keep it.
+
+    Example usage:
+
+    loader = MinibatchLoader(data['X_train'], data['y_train'], batch_size=100,
+                             prefetch=2)
+    for t in range(num_iterations):
+        X_batch, y_batch = next(loader)
+        ...
+    loader.close()
+    """
+
+    def __init__(self, X, y, batch_size=100, prefetch=2, augment_fn=None,
+                 shuffle=True, chunk_size=None, seed=None, start=0):
+        """
+        Inputs:
+        - X: Array of shape (N, d_1, ..., d_k) of data; may be a memmap or any
+          array-like that supports indexing with an integer array.
+        - y: Array of shape (N,) of labels.
+        - batch_size: Number of examples per minibatch.
+        - prefetch: Number of minibatches prepared ahead of time; 0 gathers
+          every minibatch in the calling thread.
+        - augment_fn: If not None, a function called as augment_fn(X_batch)
+          on every minibatch before it is handed over. It may modify X_batch
+          in place and must return the augmented minibatch.
+        - shuffle: If false, every epoch visits the examples in order.
+        - chunk_size: If not None, shuffle chunks of this many consecutive
+          examples and then the examples within each chunk, rather than
+          the whole dataset at once.
+        - seed: Seed of the random number generator used for shuffling;
+          by default it is drawn from np.random.
+        - start: Number of minibatches to skip, as if they had already been
+          handed out; a loader with the same seed then continues the stream
+          of one that handed out start minibatches.
+        """
+        if batch_size > X.shape[0]:
+            raise ValueError('batch_size %d is larger than the dataset (%d)'
+                             % (batch_size, X.shape[0]))
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.augment_fn = augment_fn
+        self.shuffle = shuffle
+        self.chunk_size = chunk_size
+        if seed is None:
+            seed = np.random.randint(2 ** 31)
+        self.rng = np.random.RandomState(seed)
+
+        # epoch counts the epochs of the minibatches handed out so far, while
+        # _epoch is that of the gather, which may be ahead of it.
+        self.epoch = 0
+        self._epoch = 0
+        self.iterations_per_epoch = X.shape[0] // batch_size
+        self._order = None
+        self._pos = self.iterations_per_epoch
+        for _ in range(start):
+            self._next_indices()
+        self.epoch = self._epoch
+
+        # One buffer per queued minibatch, plus one being filled by the
+        # background thread and one held by the consumer.
+        num_buffers = prefetch + 2 if prefetch > 0 else 1
+        dtype = getattr(X, 'dtype', np.float64)
+        self._buffers = [
+            (np.empty((batch_size,) + tuple(X.shape[1:]), dtype=dtype),
+             np.empty(batch_size, dtype=np.asarray(y[:1]).dtype))
+            for _ in range(num_buffers)]
+
+        self._thread = None
+        self._held = None
+        if prefetch > 0:
+            self._free = queue.Queue()
+            for i in range(num_buffers):
+                self._free.put(i)
+            self._ready = queue.Queue(maxsize=prefetch)
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _next_indices(self):
+        """
+        Return the indices of the next minibatch, starting a new epoch when
+        the current one is exhausted.
+        """
+        if self._pos == self.iterations_per_epoch:
+            if self._order is not None:
+                self._epoch += 1
+            self._order = self._epoch_order()
+            self._pos = 0
+        start = self._pos * self.batch_size
+        self._pos += 1
+        return self._order[start:start + self.batch_size]
+
+    def _epoch_order(self):
+        """
+        Return the order in which the next epoch visits the examples.
+        """
+        N = self.X.shape[0]
+        if not self.shuffle:
+            return np.arange(N)
+        if self.chunk_size is None:
+            return self.rng.permutation(N)
+        starts = self.rng.permutation(np.arange(0, N, self.chunk_size))
+        return np.concatenate([
+            start + self.rng.permutation(min(self.chunk_size, N - start))
+            for start in starts])
+
+    def _fill(self, i):
+        """
+        Gather the next minibatch into buffer i and return it, along with
+        the epoch it belongs to.
+        """
+        idx = self._next_indices()
+        if self.chunk_size is not None:
+            idx = np.sort(idx)
+        X_batch, y_batch = self._buffers[i]
+        if isinstance(self.X, np.ndarray):
+            np.take(self.X, idx, axis=0, out=X_batch)
+        else:
+            X_batch[...] = self.X[idx]
+        np.take(self.y, idx, out=y_batch)
+        if self.augment_fn is not None:
+            X_batch = self.augment_fn(X_batch)
+        return X_batch, y_batch, self._epoch
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                i = self._free.get()
+                if i is None:
+                    break
+                self._ready.put((i,) + self._fill(i))
+        except BaseException as e:
+            self._ready.put((None, e, None, None))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """
+        Return a tuple (X_batch, y_batch) holding the next minibatch.
+        """
+        if self._thread is None:
+            if not self.shuffle and self.augment_fn is None:
+                idx = self._next_indices()
+                self.epoch = self._epoch
+                start, end = idx[0], idx[-1] + 1
+                return self.X[start:end], self.y[start:end]
+            X_batch, y_batch, self.epoch = self._fill(0)
+            return X_batch, y_batch
+        if self._held is not None:
+            self._free.put(self._held)
+            self._held = None
+        i, X_batch, y_batch, epoch = self._ready.get()
+        if i is None:
+            raise X_batch
+        self._held = i
+        self.epoch = epoch
+        return X_batch, y_batch
+
+    next = __next__
+
+    def close(self):
+        """
+        Stop the background thread.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._free.put(None)
+        # Drain the queue so that a producer blocked on a full queue wakes up.
+        while self._thread.is_alive():
+            try:
+                self._ready.get(timeout=0.01)
+            except queue.Empty:
+                pass
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,192 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+import mmap
+import multiprocessing
+import traceback
+
+import numpy as np
+
+from cs231n.flat_params import FlatParams
+
+
+def shared_empty(shape, dtype):
+    """
+    Return an uninitialized array in anonymous shared memory; processes forked
+    afterwards see, and write to, the same memory.
+    """
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    buf = mmap.mmap(-1, max(count * dtype.itemsize, 1))
+    return np.frombuffer(buf, dtype=dtype, count=count).reshape(shape)
+
+
+class DataParallel(object):
+    """
+    Computes the loss and gradients of a model for a minibatch by splitting it
+    into shards that num_workers forked processes run through model.loss at
+    the same time.
+
+    The model parameters are moved into a FlatParams in shared memory before
+    the workers are forked, so every update made in place by the parent is
+    seen by all workers without copying. Each worker writes its gradients into
+    its own row of a shared (num_workers, P) buffer, where P is the total
+    number of parameters, and the parent reduces them with a single
+    matrix-vector product, weighting every shard by its size, so the result
+    equals the gradient of the whole minibatch. The minibatch itself is
+    passed through a shared input buffer.
+
+    Models that keep batch normalization statistics in a bn_params list, like
+    FullyConnectedNet, have the running averages of all workers averaged back
+    into the parent model after every step. As in other data-parallel
+    trainers, each shard is normalized with its own batch statistics, so
+    with batch normalization the gradients differ slightly from those of the
+    whole minibatch.
+
+    Each worker also runs its own BLAS threads, so it is usually best to limit
+    those, e.g. with OMP_NUM_THREADS, to the number of cores per worker.
+
+    Example usage:
+
+    parallel = DataParallel(model, 4, X_batch, y_batch)
+    loss, grads = parallel.loss(X_batch, y_batch)
+    for p in model.params:
+        model.params[p] -= learning_rate * grads[p]
+    parallel.close()
+    """
+
+    def __init__(self, model, num_workers, X_example, y_example, seed=None,
+                 params=None):
+        """
+        Inputs:
+        - model: A model object conforming to the Solver API; its params are
+          replaced with views of shared memory holding the same values.
+        - num_workers: Number of worker processes.
+        - X_example, y_example: A minibatch of the shape and dtype of all the
+          minibatches passed to loss.
+        - seed: Base seed of the workers' random number generators, which
+          drive e.g. dropout; by default it is drawn from a fresh generator
+          seeded by the operating system, which leaves the np.random stream
+          of the caller, and so e.g. the minibatches Solver samples, as it
+          would be without DataParallel.
+        - params: If not None, a FlatParams already holding model.params,
+          allocated with shared_empty; by default one is made.
+        """
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise ValueError('DataParallel needs the fork start method, '
+                             'which is not available on this platform')
+        if X_example.shape[0] < num_workers:
+            raise ValueError('Cannot split %d examples across %d workers'
+                             % (X_example.shape[0], num_workers))
+        self.model = model
+        self.num_workers = num_workers
+
+        # Lay all parameters out in one flat shared buffer
+        if params is None:
+            params = FlatParams(model.params, empty=shared_empty)
+        self.params = params
+        self.names = params.names
+
+        self.flat_grads = shared_empty((num_workers, params.size), params.dtype)
+        self.X_buf = shared_empty(X_example.shape, X_example.dtype)
+        self.y_buf = shared_empty(y_example.shape, y_example.dtype)
+        self.bounds = [(s[0], s[-1] + 1) for s in
+                       np.array_split(np.arange(X_example.shape[0]), num_workers)]
+        self.weights = np.array([hi - lo for lo, hi in self.bounds],
+                                dtype=params.dtype) / X_example.shape[0]
+
+        if seed is None:
+            seed = np.random.RandomState().randint(2 ** 31 - num_workers)
+        ctx = multiprocessing.get_context('fork')
+        self.conns = []
+        self.processes = []
+        for rank in range(num_workers):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=self._work,
+                                  args=(rank, child_conn, seed + rank))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.processes.append(process)
+
+    def _work(self, rank, conn, seed):
+        """
+        Worker loop: run model.loss on shard rank of the shared minibatch
+        whenever the parent asks for it.
+        """
+        np.random.seed(seed)
+        grad_views = dict(zip(self.names, self.params.split(self.flat_grads[rank])))
+        lo, hi = self.bounds[rank]
+        while True:
+            msg = conn.recv()
+            if msg is None:
+                break
+            bn_params, loss_scale = msg
+            try:
+                if bn_params is not None:
+                    self.model.bn_params = bn_params
+                if loss_scale is not None:
+                    self.model.loss_scale = loss_scale
+                loss, grads = self.model.loss(self.X_buf[lo:hi], self.y_buf[lo:hi])
+                for p in self.names:
+                    grad_views[p][...] = grads[p]
+                if bn_params is not None:
+                    bn_params = self.model.bn_params
+                conn.send((loss, bn_params, None))
+            except Exception:
+                conn.send((None, None, traceback.format_exc()))
+        conn.close()
+
+    def loss(self, X, y):
+        """
+        Compute the loss and gradients of the model for the minibatch X, y.
+
+        Returns a tuple of:
+        - loss: Scalar giving the loss of the whole minibatch.
+        - grads: Dictionary mapping parameter names to gradients, which are
+          the grad_views of the FlatParams and are reused by the next call.
+        """
+        if X.shape != self.X_buf.shape or y.shape != self.y_buf.shape:
+            raise ValueError('Expected a minibatch of shape %s, got %s'
+                             % (self.X_buf.shape, X.shape))
+        self.X_buf[...] = X
+        self.y_buf[...] = y
+
+        bn_params = getattr(self.model, 'bn_params', None) or None
+        loss_scale = getattr(self.model, 'loss_scale', None)
+        for conn in self.conns:
+            conn.send((bn_params, loss_scale))
+        results = [conn.recv() for conn in self.conns]
+        for rank, (_, _, error) in enumerate(results):
+            if error is not None:
+                raise RuntimeError('Worker %d failed:\n%s' % (rank, error))
+
+        loss = float(np.dot(self.weights, [r[0] for r in results]))
+        np.dot(self.weights, self.flat_grads, out=self.params.grad)
+        grads = dict(self.params.grad_views)
+
+        if bn_params is not None:
+            # Average the running statistics of all workers
+            for i, layer_params in enumerate(bn_params):
+                for k, v in results[0][1][i].items():
+                    if isinstance(v, np.ndarray):
+                        layer_params[k] = np.mean([r[1][i][k] for r in results],
+                                                  axis=0)
+        return loss, grads
+
+    def close(self):
+        """
+        Stop the worker processes. The model keeps its shared parameters.
+        """
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (EOFError, OSError):
+                pass
+        for process in self.processes:
+            process.join()
+        for conn in self.conns:
+            conn.close()
+        self.conns = []
+        self.processes = []
@@ -3,10 +3,15 @@ from __future__ import print_function
 from builtins import range
 from six.moves import cPickle as pickle
 import numpy as np
+import mmap
+import multiprocessing
 import os
-from scipy.misc import imread
+# from scipy.misc import imread # this is deprecated
+from imageio import imread # replace with this
 import platform
 
+from cs231n.file_utils import atomic_path
+
 def load_pickle(f):
     version = platform.python_version_tuple()
     if version[0] == '2':
@@ -15,42 +20,287 @@ def load_pickle(f):
         return  pickle.load(f, encoding='latin1')
     raise ValueError("invalid python version: {}".format(version))
 
-def load_CIFAR_batch(filename):
+def load_CIFAR_batch(filename, dtype="float"):
     """ load single batch of cifar """
     with open(filename, 'rb') as f:
         datadict = load_pickle(f)
         X = datadict['data']
         Y = datadict['labels']
-        X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype("float")
+        X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype(dtype)
         Y = np.array(Y)
         return X, Y
 
-def load_CIFAR10(ROOT):
-    """ load all of cifar """
+def cache_CIFAR10(ROOT, cache_dir=None):
+    """
+    Convert the pickled CIFAR-10 batches in ROOT, once, into uint8 .npy files
+    that can be memory-mapped. Images are stored both as NHWC and as NCHW so
+    neither layout needs a transpose on load.
+
+    Inputs:
+    - ROOT: Directory holding the cifar-10-batches-py files.
+    - cache_dir: Directory for the .npy files; defaults to ROOT/npy_cache.
+
+    Returns:
+    - cache_dir: The directory holding X_{train,test}_{nhwc,nchw}.npy and
+      y_{train,test}.npy.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(ROOT, 'npy_cache')
+    names = ['X_train_nhwc', 'X_train_nchw', 'y_train',
+             'X_test_nhwc', 'X_test_nchw', 'y_test']
+    paths = [os.path.join(cache_dir, name + '.npy') for name in names]
+    if all(os.path.isfile(path) for path in paths):
+        return cache_dir
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    Xtr, Ytr, Xte, Yte = load_CIFAR10(ROOT, dtype=np.uint8)
+    arrays = [Xtr, Xtr.transpose(0, 3, 1, 2), Ytr,
+              Xte, Xte.transpose(0, 3, 1, 2), Yte]
+    for path, a in zip(paths, arrays):
+        with atomic_path(path) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.ascontiguousarray(a))
+    return cache_dir
+
+def load_CIFAR10(ROOT, dtype="float", mmap_mode=None, layout='NHWC',
+                 cache_dir=None):
+    """
+    load all of cifar
+
+    By default the pickled batches are decoded and cast to dtype on every
+    call. If mmap_mode is given (e.g. 'r'), the uint8 cache written by
+    cache_CIFAR10 is memory-mapped instead, building it on first use; loading
+    is then near-instant and all processes share one copy in the page cache.
+
+    Inputs:
+    - ROOT: Directory holding the cifar-10-batches-py files.
+    - dtype: Datatype of the returned images when not memory-mapping.
+    - mmap_mode: None, or a np.load mmap_mode for the uint8 cache.
+    - layout: 'NHWC' or 'NCHW'; layout of the memory-mapped images.
+    - cache_dir: Cache directory for cache_CIFAR10.
+
+    Returns a tuple of X_train, y_train, X_test, y_test.
+    """
+    if mmap_mode is not None:
+        if layout not in ('NHWC', 'NCHW'):
+            raise ValueError('Invalid layout "%s"' % layout)
+        cache_dir = cache_CIFAR10(ROOT, cache_dir)
+        def load(name):
+            return np.load(os.path.join(cache_dir, name + '.npy'),
+                           mmap_mode=mmap_mode)
+        suffix = layout.lower()
+        return (load('X_train_' + suffix), load('y_train'),
+                load('X_test_' + suffix), load('y_test'))
+
     xs = []
     ys = []
     for b in range(1,6):
         f = os.path.join(ROOT, 'data_batch_%d' % (b, ))
-        X, Y = load_CIFAR_batch(f)
+        X, Y = load_CIFAR_batch(f, dtype)
         xs.append(X)
         ys.append(Y)
     Xtr = np.concatenate(xs)
     Ytr = np.concatenate(ys)
     del X, Y
-    Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'))
+    Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'), dtype)
     return Xtr, Ytr, Xte, Yte
 
 
+class LazyImageArray(object):
+    """
+    A read-only, array-like view of rows start, ..., stop - 1 of a stack of
+    raw (typically uint8, possibly memory-mapped) images. Conversion to dtype,
+    mean subtraction and the layout transpose are applied only to the rows
+    that are indexed, so a minibatch costs a minibatch worth of work and
+    memory, while the dataset itself stays in its raw storage.
+
+    Supports len(), .shape, .dtype, and indexing the first axis with integers,
+    slices, integer arrays and boolean masks, which is all that Solver needs.
+    """
+
+    def __init__(self, data, start=0, stop=None, mean_image=None,
+                 dtype=np.float64, transpose=None):
+        """
+        Inputs:
+        - data: Array of shape (N, d_1, ..., d_k) of raw images.
+        - start, stop: Range of rows of data covered by this view.
+        - mean_image: If not None, array of shape (d_1, ..., d_k) subtracted
+          from every converted row.
+        - dtype: Datatype of the rows returned by indexing.
+        - transpose: If not None, axes order applied to every converted batch,
+          e.g. (0, 3, 1, 2) to turn NHWC images into NCHW.
+        """
+        if stop is None:
+            stop = data.shape[0]
+        self.data = data
+        self.start = start
+        self.stop = stop
+        self.dtype = np.dtype(dtype)
+        self.mean_image = None
+        if mean_image is not None:
+            self.mean_image = mean_image.astype(self.dtype)
+        self.transpose = transpose
+        row_shape = data.shape[1:]
+        if transpose is not None:
+            row_shape = tuple(row_shape[i - 1] for i in transpose[1:])
+        self.shape = (stop - start,) + row_shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+        n = len(self)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(n)
+            stop += self.start
+            if stop < 0:  # a negative step running past the first row
+                stop = None
+            rows = slice(self.start + start, stop, step)
+            squeeze = False
+        elif np.ndim(key) == 0:
+            index = int(key)
+            if not -n <= index < n:
+                raise IndexError('index %d is out of bounds for size %d'
+                                 % (index, n))
+            rows = [self.start + index % n]
+            squeeze = True
+        else:
+            index = np.asarray(key)
+            if index.dtype == bool:
+                index = np.flatnonzero(index)
+            if index.size > 0 and (index.min() < -n or index.max() >= n):
+                raise IndexError('index out of bounds for size %d' % n)
+            rows = self.start + index % n
+            squeeze = False
+
+        batch = self.data[rows].astype(self.dtype)
+        if self.mean_image is not None:
+            batch -= self.mean_image
+        if self.transpose is not None:
+            batch = np.ascontiguousarray(batch.transpose(self.transpose))
+        if squeeze:
+            batch = batch[0]
+        return batch[rest] if rest else batch
+
+    def __array__(self, dtype=None, copy=None):
+        a = self[:]
+        return a if dtype is None else a.astype(dtype)
+
+
+class ChunkedArray(object):
+    """
+    A read-only, array-like concatenation along the first axis of a list of
+    chunks, typically the .npy chunk files of a dataset too large for memory
+    (see save_chunks), each opened as a memory map.
+
+    Supports len(), .shape, .dtype, and indexing the first axis with integers,
+    slices, integer arrays and boolean masks. Fancy indexing reads every
+    chunk once, in increasing row order, and returns an in-memory array.
+    """
+
+    def __init__(self, chunks, mmap_mode='r'):
+        """
+        Inputs:
+        - chunks: List of arrays of shape (N_i, d_1, ..., d_k), or of paths to
+          .npy files holding them.
+        - mmap_mode: np.load mmap_mode used to open the chunks given as paths.
+        """
+        self.chunks = [np.load(c, mmap_mode=mmap_mode) if isinstance(c, str)
+                       else c for c in chunks]
+        lengths = [c.shape[0] for c in self.chunks]
+        self.offsets = np.cumsum([0] + lengths)
+        self.chunk_size = max(lengths)
+        self.dtype = self.chunks[0].dtype
+        self.shape = (int(self.offsets[-1]),) + tuple(self.chunks[0].shape[1:])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+        n = len(self)
+        if isinstance(key, slice):
+            index = np.arange(*key.indices(n))
+        elif np.ndim(key) == 0:
+            index = int(key)
+            if not -n <= index < n:
+                raise IndexError('index %d is out of bounds for size %d'
+                                 % (index, n))
+            index %= n
+            c = np.searchsorted(self.offsets, index, side='right') - 1
+            row = self.chunks[c][index - self.offsets[c]]
+            return row[rest] if rest else row
+        else:
+            index = np.asarray(key)
+            if index.dtype == bool:
+                index = np.flatnonzero(index)
+            if index.size > 0 and (index.min() < -n or index.max() >= n):
+                raise IndexError('index out of bounds for size %d' % n)
+            index = index % n
+
+        # Visit the rows in increasing order, one chunk at a time
+        order = np.argsort(index, kind='mergesort')
+        sorted_index = index[order]
+        bounds = np.searchsorted(sorted_index, self.offsets)
+        out = np.empty((index.shape[0],) + self.shape[1:], dtype=self.dtype)
+        for c, chunk in enumerate(self.chunks):
+            lo, hi = bounds[c], bounds[c + 1]
+            if lo < hi:
+                out[order[lo:hi]] = chunk[sorted_index[lo:hi] - self.offsets[c]]
+        return out[(slice(None),) + rest] if rest else out
+
+    def __array__(self, dtype=None, copy=None):
+        a = self[:]
+        return a if dtype is None else a.astype(dtype)
+
+
+def save_chunks(X, prefix, chunk_size):
+    """
+    Write X to .npy files of chunk_size rows each, to be opened as a
+    ChunkedArray.
+
+    Inputs:
+    - X: Array of shape (N, d_1, ..., d_k); may be a memmap.
+    - prefix: Path prefix of the chunk files, which are named
+      prefix_00000.npy, prefix_00001.npy, ...
+    - chunk_size: Number of rows per chunk file.
+
+    Returns:
+    - paths: List of the paths of the chunk files, in order.
+    """
+    paths = []
+    for i, start in enumerate(range(0, X.shape[0], chunk_size)):
+        path = '%s_%05d.npy' % (prefix, i)
+        np.save(path, np.ascontiguousarray(X[start:start + chunk_size]))
+        paths.append(path)
+    return paths
+
+
 def get_CIFAR10_data(num_training=49000, num_validation=1000, num_test=1000,
-                     subtract_mean=True):
+                     subtract_mean=True, dtype=np.float64, lazy=False):
     """
     Load the CIFAR-10 dataset from disk and perform preprocessing to prepare
     it for classifiers. These are the same steps as we used for the SVM, but
     condensed to a single function.
+
+    If lazy is True the images stay in the memory-mapped uint8 cache of
+    load_CIFAR10, and X_train, X_val and X_test are LazyImageArray views that
+    convert to dtype, subtract the mean image and transpose to NCHW only for
+    the rows that are indexed, e.g. one minibatch at a time in Solver.
     """
     # Load the raw CIFAR-10 data
     cifar10_dir = 'cs231n/datasets/cifar-10-batches-py'
-    X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir)
+    if lazy:
+        return _get_CIFAR10_data_lazy(cifar10_dir, num_training,
+                                      num_validation, num_test, subtract_mean,
+                                      dtype)
+    X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir, dtype)
 
     # Subsample the data
     mask = list(range(num_training, num_training + num_validation))
@@ -83,102 +333,174 @@ def get_CIFAR10_data(num_training=49000, num_validation=1000, num_test=1000,
     }
 
 
-def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
+def _get_CIFAR10_data_lazy(cifar10_dir, num_training, num_validation,
+                           num_test, subtract_mean, dtype, chunk_size=5000):
+    X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir,
+                                                    mmap_mode='r')
+
+    # Accumulate the mean image a chunk at a time to keep memory flat
+    mean_image = None
+    if subtract_mean:
+        total = np.zeros(X_train.shape[1:])
+        for start in range(0, num_training, chunk_size):
+            stop = min(start + chunk_size, num_training)
+            total += np.sum(X_train[start:stop], axis=0, dtype=np.float64)
+        mean_image = total / num_training
+
+    def split(X, start, stop):
+        return LazyImageArray(X, start, stop, mean_image, dtype,
+                              transpose=(0, 3, 1, 2))
+
+    return {
+      'X_train': split(X_train, 0, num_training),
+      'y_train': np.asarray(y_train[:num_training]),
+      'X_val': split(X_train, num_training, num_training + num_validation),
+      'y_val': np.asarray(y_train[num_training:num_training + num_validation]),
+      'X_test': split(X_test, 0, num_test),
+      'y_test': np.asarray(y_test[:num_test]),
+    }
+
+
+def _read_tiny_image(filename):
+    img = imread(filename)
+    if img.ndim == 2:
+        ## grayscale file
+        img = img[:, :, None]
+    return img.transpose(2, 0, 1)
+
+
+def _decode_block(args):
     """
-    Load TinyImageNet. Each of TinyImageNet-100-A, TinyImageNet-100-B, and
-    TinyImageNet-200 have the same directory structure, so this can be used
-    to load any of them.
+    Decode one list of image files. If out_spec is given the images are
+    written straight into rows offset, offset + 1, ... of the memmap it
+    describes and None is returned; otherwise the decoded uint8 block is.
+    """
+    out_spec, offset, filenames = args
+    if out_spec is None:
+        block = np.empty((len(filenames), 3, 64, 64), dtype=np.uint8)
+    else:
+        filename, dtype, byte_offset, shape = out_spec
+        out = np.memmap(filename, dtype=dtype, mode='r+', offset=byte_offset,
+                        shape=shape)
+        block = out[offset:offset + len(filenames)]
+    for j, filename in enumerate(filenames):
+        block[j] = _read_tiny_image(filename)
+    if out_spec is None:
+        return offset, block
+    out.flush()
+    return offset, None
+
+
+def decode_images(file_lists, out=None, n_jobs=1):
+    """
+    Decode lists of 64x64 image files into a single (N, 3, 64, 64) array,
+    one list per task on a pool of n_jobs worker processes.
+
+    If out is a memmap (as returned by np.memmap or
+    np.lib.format.open_memmap) the workers open the same file and write
+    their images straight into it, so no pixel data passes through this
+    process. Otherwise every decoded block is sent back and copied into out.
 
     Inputs:
-    - path: String giving path to the directory to load.
-    - dtype: numpy datatype used to load the data.
-    - subtract_mean: Whether to subtract the mean training image.
+    - file_lists: List of lists of image paths, e.g. one list per synset. The
+      images are stored in order, list after list.
+    - out: If not None, array of shape (N, 3, 64, 64) to decode into, where N
+      is the total number of files. Defaults to a new uint8 array.
+    - n_jobs: Number of worker processes; 1 decodes in this process.
 
-    Returns: A dictionary with the following entries:
-    - class_names: A list where class_names[i] is a list of strings giving the
-      WordNet names for class i in the loaded dataset.
-    - X_train: (N_tr, 3, 64, 64) array of training images
-    - y_train: (N_tr,) array of training labels
-    - X_val: (N_val, 3, 64, 64) array of validation images
-    - y_val: (N_val,) array of validation labels
-    - X_test: (N_test, 3, 64, 64) array of testing images.
-    - y_test: (N_test,) array of test labels; if test labels are not available
-      (such as in student code) then y_test will be None.
-    - mean_image: (3, 64, 64) array giving mean training image
+    Returns:
+    - out: The array holding the decoded images.
+    """
+    num_images = sum(len(filenames) for filenames in file_lists)
+    if out is None:
+        out = np.empty((num_images, 3, 64, 64), dtype=np.uint8)
+    offsets = np.cumsum([0] + [len(filenames) for filenames in file_lists])
+
+    if n_jobs == 1:
+        for offset, filenames in zip(offsets, file_lists):
+            for j, filename in enumerate(filenames):
+                out[offset + j] = _read_tiny_image(filename)
+        return out
+
+    # Only a memmap that owns its mapping has a meaningful offset; slices of
+    # one inherit the offset of their parent.
+    out_spec = None
+    if isinstance(out, np.memmap) and isinstance(out.base, mmap.mmap):
+        out.flush()
+        out_spec = (out.filename, out.dtype.str, out.offset, out.shape)
+    tasks = [(out_spec, int(offset), filenames)
+             for offset, filenames in zip(offsets, file_lists) if filenames]
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+        for offset, block in pool.imap_unordered(_decode_block, tasks):
+            if block is not None:
+                out[offset:offset + block.shape[0]] = block
+    finally:
+        pool.close()
+        pool.join()
+    return out
+
+
+def _tiny_imagenet_classes(path):
+    """
+    Return the wnids of TinyImageNet and the list of WordNet names per class.
     """
     # First load wnids
     with open(os.path.join(path, 'wnids.txt'), 'r') as f:
         wnids = [x.strip() for x in f]
 
-    # Map wnids to integer labels
-    wnid_to_label = {wnid: i for i, wnid in enumerate(wnids)}
-
     # Use words.txt to get names for each class
     with open(os.path.join(path, 'words.txt'), 'r') as f:
         wnid_to_words = dict(line.split('\t') for line in f)
         for wnid, words in wnid_to_words.items():
             wnid_to_words[wnid] = [w.strip() for w in words.split(',')]
     class_names = [wnid_to_words[wnid] for wnid in wnids]
+    return wnids, class_names
+
+
+def _tiny_imagenet_files(path, wnids, block_size=500):
+    """
+    List the image files and labels of every split of TinyImageNet.
 
-    # Next load training data.
-    X_train = []
+    Returns a dictionary with the following entries:
+    - train_files, val_files, test_files: Lists of lists of image paths; one
+      list per synset for training and blocks of block_size otherwise.
+    - y_train, y_val: Arrays of labels.
+    - y_test: Array of test labels, or None if they are not available.
+    """
+    # Map wnids to integer labels
+    wnid_to_label = {wnid: i for i, wnid in enumerate(wnids)}
+
+    train_files = []
     y_train = []
-    for i, wnid in enumerate(wnids):
-        if (i + 1) % 20 == 0:
-            print('loading training data for synset %d / %d'
-                  % (i + 1, len(wnids)))
+    for wnid in wnids:
         # To figure out the filenames we need to open the boxes file
         boxes_file = os.path.join(path, 'train', wnid, '%s_boxes.txt' % wnid)
         with open(boxes_file, 'r') as f:
             filenames = [x.split('\t')[0] for x in f]
-        num_images = len(filenames)
-
-        X_train_block = np.zeros((num_images, 3, 64, 64), dtype=dtype)
-        y_train_block = wnid_to_label[wnid] * \
-                        np.ones(num_images, dtype=np.int64)
-        for j, img_file in enumerate(filenames):
-            img_file = os.path.join(path, 'train', wnid, 'images', img_file)
-            img = imread(img_file)
-            if img.ndim == 2:
-        ## grayscale file
-                img.shape = (64, 64, 1)
-            X_train_block[j] = img.transpose(2, 0, 1)
-        X_train.append(X_train_block)
-        y_train.append(y_train_block)
-
-    # We need to concatenate all training data
-    X_train = np.concatenate(X_train, axis=0)
+        train_files.append([os.path.join(path, 'train', wnid, 'images', img_file)
+                            for img_file in filenames])
+        y_train.append(wnid_to_label[wnid] *
+                       np.ones(len(filenames), dtype=np.int64))
     y_train = np.concatenate(y_train, axis=0)
 
-    # Next load validation data
     with open(os.path.join(path, 'val', 'val_annotations.txt'), 'r') as f:
         img_files = []
         val_wnids = []
         for line in f:
             img_file, wnid = line.split('\t')[:2]
-            img_files.append(img_file)
+            img_files.append(os.path.join(path, 'val', 'images', img_file))
             val_wnids.append(wnid)
-        num_val = len(img_files)
-        y_val = np.array([wnid_to_label[wnid] for wnid in val_wnids])
-        X_val = np.zeros((num_val, 3, 64, 64), dtype=dtype)
-        for i, img_file in enumerate(img_files):
-            img_file = os.path.join(path, 'val', 'images', img_file)
-            img = imread(img_file)
-            if img.ndim == 2:
-                img.shape = (64, 64, 1)
-            X_val[i] = img.transpose(2, 0, 1)
-
-    # Next load test images
+    y_val = np.array([wnid_to_label[wnid] for wnid in val_wnids])
+    val_files = [img_files[i:i + block_size]
+                 for i in range(0, len(img_files), block_size)]
+
     # Students won't have test labels, so we need to iterate over files in the
     # images directory.
     img_files = os.listdir(os.path.join(path, 'test', 'images'))
-    X_test = np.zeros((len(img_files), 3, 64, 64), dtype=dtype)
-    for i, img_file in enumerate(img_files):
-        img_file = os.path.join(path, 'test', 'images', img_file)
-        img = imread(img_file)
-        if img.ndim == 2:
-            img.shape = (64, 64, 1)
-        X_test[i] = img.transpose(2, 0, 1)
+    test_files = [[os.path.join(path, 'test', 'images', img_file)
+                   for img_file in img_files[i:i + block_size]]
+                  for i in range(0, len(img_files), block_size)]
 
     y_test = None
     y_test_file = os.path.join(path, 'test', 'test_annotations.txt')
@@ -192,8 +514,128 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
                   for img_file in img_files]
         y_test = np.array(y_test)
 
-    mean_image = X_train.mean(axis=0)
-    if subtract_mean:
+    return {
+      'train_files': train_files, 'y_train': y_train,
+      'val_files': val_files, 'y_val': y_val,
+      'test_files': test_files, 'y_test': y_test,
+    }
+
+
+def cache_tiny_imagenet(path, cache_dir=None, n_jobs=1):
+    """
+    Decode TinyImageNet, once, into a packed uint8 cache that can be loaded
+    with a single memory map.
+
+    The cache holds images.npy, all training, validation and test images
+    stacked in that order as an (N, 3, 64, 64) uint8 array, and labels.npz
+    with y_train, y_val and, if available, y_test. The workers of
+    decode_images write straight into the memory-mapped images.npy.
+
+    Inputs:
+    - path: String giving path to the TinyImageNet directory.
+    - cache_dir: Directory for the cache; defaults to path/npy_cache.
+    - n_jobs: Number of worker processes used to decode the images.
+
+    Returns:
+    - cache_dir: The directory holding images.npy and labels.npz.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(path, 'npy_cache')
+    images_path = os.path.join(cache_dir, 'images.npy')
+    labels_path = os.path.join(cache_dir, 'labels.npz')
+    if os.path.isfile(images_path) and os.path.isfile(labels_path):
+        return cache_dir
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    wnids, _ = _tiny_imagenet_classes(path)
+    files = _tiny_imagenet_files(path, wnids)
+    file_lists = files['train_files'] + files['val_files'] + files['test_files']
+    num_images = sum(len(filenames) for filenames in file_lists)
+    labels = {'y_train': files['y_train'], 'y_val': files['y_val']}
+    if files['y_test'] is not None:
+        labels['y_test'] = files['y_test']
+
+    # images.npy, whose presence marks the cache as complete, is moved into
+    # place last.
+    with atomic_path(images_path) as tmp_images_path:
+        images = np.lib.format.open_memmap(tmp_images_path, mode='w+',
+                                           dtype=np.uint8,
+                                           shape=(num_images, 3, 64, 64))
+        decode_images(file_lists, out=images, n_jobs=n_jobs)
+        images.flush()
+        del images
+        with atomic_path(labels_path) as tmp_labels_path:
+            with open(tmp_labels_path, 'wb') as f:
+                np.savez(f, **labels)
+    return cache_dir
+
+
+def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True, n_jobs=1,
+                       mmap_mode=None, cache_dir=None):
+    """
+    Load TinyImageNet. Each of TinyImageNet-100-A, TinyImageNet-100-B, and
+    TinyImageNet-200 have the same directory structure, so this can be used
+    to load any of them.
+
+    Images are decoded on n_jobs worker processes. If mmap_mode or cache_dir
+    is given, the packed uint8 cache of cache_tiny_imagenet is used instead,
+    building it on first use, so later loads are a single memory map.
+
+    Inputs:
+    - path: String giving path to the directory to load.
+    - dtype: numpy datatype used to load the data. If None, the images are
+      returned as uint8 (memory-mapped when loaded from the cache) and
+      subtract_mean is ignored.
+    - subtract_mean: Whether to subtract the mean training image.
+    - n_jobs: Number of worker processes used to decode the images.
+    - mmap_mode: None, or a np.load mmap_mode for the cached images.
+    - cache_dir: Cache directory for cache_tiny_imagenet.
+
+    Returns: A dictionary with the following entries:
+    - class_names: A list where class_names[i] is a list of strings giving the
+      WordNet names for class i in the loaded dataset.
+    - X_train: (N_tr, 3, 64, 64) array of training images
+    - y_train: (N_tr,) array of training labels
+    - X_val: (N_val, 3, 64, 64) array of validation images
+    - y_val: (N_val,) array of validation labels
+    - X_test: (N_test, 3, 64, 64) array of testing images.
+    - y_test: (N_test,) array of test labels; if test labels are not available
+      (such as in student code) then y_test will be None.
+    - mean_image: (3, 64, 64) array giving mean training image
+    """
+    wnids, class_names = _tiny_imagenet_classes(path)
+
+    if mmap_mode is None and cache_dir is None:
+        files = _tiny_imagenet_files(path, wnids)
+        y_train, y_val, y_test = files['y_train'], files['y_val'], files['y_test']
+        def decode(file_lists):
+            num_images = sum(len(filenames) for filenames in file_lists)
+            out = np.empty((num_images, 3, 64, 64),
+                           dtype=np.uint8 if dtype is None else dtype)
+            return decode_images(file_lists, out=out, n_jobs=n_jobs)
+        X_train = decode(files['train_files'])
+        X_val = decode(files['val_files'])
+        X_test = decode(files['test_files'])
+    else:
+        cache_dir = cache_tiny_imagenet(path, cache_dir, n_jobs)
+        images = np.load(os.path.join(cache_dir, 'images.npy'),
+                         mmap_mode=mmap_mode or 'r')
+        labels = np.load(os.path.join(cache_dir, 'labels.npz'))
+        y_train, y_val = labels['y_train'], labels['y_val']
+        y_test = labels['y_test'] if 'y_test' in labels else None
+        num_train, num_val = y_train.shape[0], y_val.shape[0]
+        X_train = images[:num_train]
+        X_val = images[num_train:num_train + num_val]
+        X_test = images[num_train + num_val:]
+        if dtype is not None:
+            X_train = np.array(X_train, dtype=dtype)
+            X_val = np.array(X_val, dtype=dtype)
+            X_test = np.array(X_test, dtype=dtype)
+
+    mean_image = X_train.mean(axis=0, dtype=np.float64)
+    mean_image = mean_image.astype(np.float32 if dtype is None else dtype)
+    if subtract_mean and dtype is not None:
         X_train -= mean_image[None]
         X_val -= mean_image[None]
         X_test -= mean_image[None]
@@ -0,0 +1,84 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+import numpy as np
+
+
+class FlatParams(object):
+    """
+    A FlatParams packs the parameters of a model into one contiguous flat
+    buffer and replaces every entry of the parameter dictionary with a view of
+    its segment of that buffer, so that the model keeps reading and writing
+    its parameters as before while an update rule can process all of them
+    with a single vectorized call. A second buffer of the same layout holds
+    the gradients.
+
+    The parameters are laid out one after another in the order of the
+    dictionary; parameter names[i] occupies data[offsets[i]:offsets[i + 1]],
+    which layer-wise update rules can use to treat every tensor separately.
+
+    Example usage:
+
+    flat = FlatParams(model.params)
+    loss, grads = model.loss(X_batch, y_batch)
+    dw = flat.flatten_grads(grads)
+    flat.data -= learning_rate * dw  # updates every array in model.params
+    """
+
+    def __init__(self, params, empty=np.empty):
+        """
+        Inputs:
+        - params: Dictionary mapping parameter names to arrays; its values are
+          replaced with views of the flat buffer holding the same values.
+        - empty: Function called as empty(shape, dtype) to allocate the
+          buffers, such as data_parallel.shared_empty for buffers that forked
+          processes share.
+        """
+        self.names = list(params)
+        self.shapes = [params[p].shape for p in self.names]
+        self.dtype = np.result_type(*[params[p] for p in self.names])
+        sizes = [params[p].size for p in self.names]
+        self.offsets = np.cumsum([0] + sizes)
+        self.size = int(self.offsets[-1])
+
+        self.data = empty(self.size, self.dtype)
+        self.grad = empty(self.size, self.dtype)
+        self.views = dict(zip(self.names, self.split(self.data)))
+        self.grad_views = dict(zip(self.names, self.split(self.grad)))
+        for p in self.names:
+            self.views[p][...] = params[p]
+            params[p] = self.views[p]
+
+    def split(self, flat):
+        """
+        Return the parameter-shaped views of a flat array of this layout, in
+        the order of names.
+        """
+        return [flat[lo:hi].reshape(shape) for lo, hi, shape in
+                zip(self.offsets[:-1], self.offsets[1:], self.shapes)]
+
+    def segments(self):
+        """
+        Return a dictionary mapping parameter names to the (start, end)
+        offsets of their segments.
+        """
+        return {p: (int(lo), int(hi)) for p, lo, hi in
+                zip(self.names, self.offsets[:-1], self.offsets[1:])}
+
+    def flatten_grads(self, grads):
+        """
+        Copy a dictionary of gradients into the flat gradient buffer and
+        return it. Gradients that already are views of the buffer, such as
+        those in grad_views, are not copied.
+        """
+        for p in self.names:
+            if grads[p] is not self.grad_views[p]:
+                self.grad_views[p][...] = grads[p]
+        return self.grad
+
+    def load(self, params):
+        """
+        Copy the values of a dictionary of parameters into the flat buffer.
+        """
+        for p, w in params.items():
+            self.views[p][...] = w
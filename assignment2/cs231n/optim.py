@@ -26,9 +26,22 @@ perform well; however the default values of the other hyperparameters should
 work well for a variety of different problems.
 
 For efficiency, update rules may perform in-place updates, mutating w and
-setting next_w equal to w.
+setting next_w equal to w. The *_inplace rules below always do so, and also
+update their cached values in place, using a scratch buffer kept in the config
+under '_scratch'; after the first step they allocate no memory. If numexpr is
+installed they evaluate each update as a single fused expression instead.
+
+The layer-wise rules lars and lamb scale the step of every parameter tensor by
+the ratio of its norm to that of its update. When w packs many tensors into one
+flat array, as the Solver does with flat_params, config['_segments'] holds the
+offsets of their segments, so that the norms are taken per segment.
 """
 
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
 
 def sgd(w, dw, config=None):
     """
@@ -151,3 +164,248 @@ def adam(x, dx, config=None):
     ###########################################################################
 
     return next_x, config
+
+
+def _scratch(config, x):
+    """
+    Return a scratch buffer like x that is kept in config between steps.
+    """
+    buf = config.get('_scratch')
+    if buf is None or buf.shape != x.shape or buf.dtype != x.dtype:
+        buf = np.empty_like(x)
+        config['_scratch'] = buf
+    return buf
+
+
+def sgd_momentum_inplace(w, dw, config=None):
+    """
+    Performs stochastic gradient descent with momentum, like sgd_momentum, but
+    updates w and the velocity in place.
+
+    config format: Same as for sgd_momentum.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-2)
+    config.setdefault('momentum', 0.9)
+    # Allocate the state only once; setdefault would allocate every step
+    if 'velocity' not in config: config['velocity'] = np.zeros_like(w)
+    v = config['velocity']
+    lr, mu = config['learning_rate'], config['momentum']
+
+    if numexpr is not None:
+        numexpr.evaluate('mu * v - lr * dw', out=v, casting='same_kind')
+    else:
+        s = _scratch(config, w)
+        v *= mu
+        np.multiply(dw, lr, out=s)
+        v -= s
+    w += v
+
+    return w, config
+
+
+def rmsprop_inplace(x, dx, config=None):
+    """
+    Uses the RMSProp update rule, like rmsprop, but updates x and the squared
+    gradient cache in place.
+
+    config format: Same as for rmsprop.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-2)
+    config.setdefault('decay_rate', 0.99)
+    config.setdefault('epsilon', 1e-8)
+    if 'cache' not in config: config['cache'] = np.zeros_like(x)
+    cache = config['cache']
+    lr, decay, eps = (config['learning_rate'], config['decay_rate'],
+                      config['epsilon'])
+
+    if numexpr is not None:
+        numexpr.evaluate('decay * cache + (1 - decay) * dx * dx', out=cache,
+                         casting='same_kind')
+        numexpr.evaluate('x - lr * dx / (sqrt(cache) + eps)', out=x,
+                         casting='same_kind')
+    else:
+        s = _scratch(config, x)
+        cache *= decay
+        np.multiply(dx, dx, out=s)
+        s *= 1 - decay
+        cache += s
+        np.sqrt(cache, out=s)
+        s += eps
+        np.divide(dx, s, out=s)
+        s *= lr
+        x -= s
+
+    return x, config
+
+
+def adam_inplace(x, dx, config=None):
+    """
+    Uses the Adam update rule exactly as adam does, but updates x and the
+    moment estimates in place. As in adam, the iteration number t defaults
+    to 1 and is not incremented, and epsilon is added to the square root of
+    the bias corrected second moment.
+
+    config format: Same as for adam.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-3)
+    config.setdefault('beta1', 0.9)
+    config.setdefault('beta2', 0.999)
+    config.setdefault('epsilon', 1e-8)
+    if 'm' not in config: config['m'] = np.zeros_like(x)
+    if 'v' not in config: config['v'] = np.zeros_like(x)
+    config.setdefault('t', 1)
+    m, v = config['m'], config['v']
+    beta1, beta2, eps = config['beta1'], config['beta2'], config['epsilon']
+    t = config['t']
+    # Python floats, as float64 scalars would make float32 updates buffer
+    alpha = config['learning_rate'] / (1 - beta1 ** t)
+    c2 = 1.0 / (1 - beta2 ** t)
+
+    if numexpr is not None:
+        numexpr.evaluate('beta1 * m + (1 - beta1) * dx', out=m,
+                         casting='same_kind')
+        numexpr.evaluate('beta2 * v + (1 - beta2) * dx * dx', out=v,
+                         casting='same_kind')
+        numexpr.evaluate('x - alpha * m / (sqrt(c2 * v) + eps)', out=x,
+                         casting='same_kind')
+    else:
+        s = _scratch(config, x)
+        m *= beta1
+        np.multiply(dx, 1 - beta1, out=s)
+        m += s
+        v *= beta2
+        np.multiply(dx, dx, out=s)
+        s *= 1 - beta2
+        v += s
+        np.multiply(v, c2, out=s)
+        np.sqrt(s, out=s)
+        s += eps
+        np.divide(m, s, out=s)
+        s *= alpha
+        x -= s
+
+    return x, config
+
+
+def _segment_norms(x, config):
+    """
+    Return the L2 norms of the segments of x given by config['_segments'], or
+    the norm of all of x as a single segment.
+    """
+    offsets = config.get('_segments')
+    sq = np.square(x).ravel()
+    if offsets is None:
+        return np.sqrt(np.sum(sq)).reshape(1)
+    return np.sqrt(np.add.reduceat(sq, offsets[:-1]))
+
+
+def _expand_segments(ratios, x, config):
+    """
+    Return the per-segment values ratios broadcast to the shape of x, in the
+    dtype of x.
+    """
+    offsets = config.get('_segments')
+    if offsets is None:
+        return float(ratios[0])
+    ratios = ratios.astype(x.dtype)
+    return np.repeat(ratios, np.diff(offsets)).reshape(x.shape)
+
+
+def _trust_ratio(w_norm, update_norm, scale=1.0):
+    """
+    Return scale * w_norm / update_norm per segment, or 1 where either norm
+    is zero, such as for parameters initialized to zero.
+    """
+    ok = (w_norm > 0) & (update_norm > 0)
+    return np.where(ok, scale * w_norm / np.where(ok, update_norm, 1), 1.0)
+
+
+def lars(w, dw, config=None):
+    """
+    Uses LARS, layer-wise adaptive rate scaling, which is SGD with momentum
+    where the step of every parameter tensor is scaled by trust_coefficient
+    times the ratio of the norm of the tensor to that of its gradient, so that
+    every layer moves by a similar fraction of its size. This keeps training
+    stable at batch sizes where sgd_momentum diverges.
+
+    config format:
+    - learning_rate: Scalar learning rate.
+    - momentum: Scalar between 0 and 1 giving the momentum value.
+    - trust_coefficient: Scalar giving the fraction of the norm of a tensor
+      that it moves by per step, before the learning rate.
+    - weight_decay: Scalar L2 weight decay, added to the gradient; the models
+      usually apply their reg in the loss instead.
+    - epsilon: Small scalar used for smoothing to avoid dividing by zero.
+    - velocity: A numpy array of the same shape as w used to store a moving
+      average of the scaled updates.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-2)
+    config.setdefault('momentum', 0.9)
+    config.setdefault('trust_coefficient', 1e-3)
+    config.setdefault('weight_decay', 0.0)
+    config.setdefault('epsilon', 1e-8)
+    if 'velocity' not in config: config['velocity'] = np.zeros_like(w)
+    wd = config['weight_decay']
+
+    w_norm = _segment_norms(w, config)
+    dw_norm = _segment_norms(dw, config)
+    ratio = _trust_ratio(w_norm, dw_norm + wd * w_norm + config['epsilon'],
+                         config['trust_coefficient'])
+    update = dw + wd * w if wd else dw
+    v = config['momentum'] * config['velocity'] - (
+        config['learning_rate'] * _expand_segments(ratio, w, config) * update)
+    next_w = w + v
+    config['velocity'] = v
+
+    return next_w, config
+
+
+def lamb(x, dx, config=None):
+    """
+    Uses LAMB, layer-wise adaptive moments for batch training, which computes
+    the Adam update with decoupled weight decay and scales it, for every
+    parameter tensor, by the ratio of the norm of the tensor to that of the
+    update. Unlike in adam, the iteration number t starts at 0 and is
+    incremented before every update.
+
+    config format:
+    - learning_rate: Scalar learning rate.
+    - beta1: Decay rate for moving average of first moment of gradient.
+    - beta2: Decay rate for moving average of second moment of gradient.
+    - epsilon: Small scalar used for smoothing to avoid dividing by zero.
+    - weight_decay: Scalar weight decay, added to the Adam update.
+    - m: Moving average of gradient.
+    - v: Moving average of squared gradient.
+    - t: Iteration number.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-3)
+    config.setdefault('beta1', 0.9)
+    config.setdefault('beta2', 0.999)
+    config.setdefault('epsilon', 1e-6)
+    config.setdefault('weight_decay', 0.0)
+    if 'm' not in config: config['m'] = np.zeros_like(x)
+    if 'v' not in config: config['v'] = np.zeros_like(x)
+    config.setdefault('t', 0)
+    beta1, beta2 = config['beta1'], config['beta2']
+    config['t'] += 1
+    t = config['t']
+
+    config['m'] = beta1 * config['m'] + (1 - beta1) * dx
+    config['v'] = beta2 * config['v'] + (1 - beta2) * (dx * dx)
+    mt = config['m'] / (1 - beta1 ** t)
+    vt = config['v'] / (1 - beta2 ** t)
+    update = mt / (np.sqrt(vt) + config['epsilon'])
+    if config['weight_decay']:
+        update += config['weight_decay'] * x
+
+    ratio = _trust_ratio(_segment_norms(x, config),
+                         _segment_norms(update, config))
+    step = config['learning_rate'] * _expand_segments(ratio, x, config)
+    next_x = x - step * update
+
+    return next_x, config
@@ -3,12 +3,27 @@ from future import standard_library
 standard_library.install_aliases()
 from builtins import range
 from builtins import object
+import json
 import os
 import pickle as pickle
+import threading
+import time
 
 import numpy as np
 
 from cs231n import optim
+from cs231n.data_loader import MinibatchLoader
+from cs231n.data_parallel import DataParallel, shared_empty
+from cs231n.file_utils import atomic_path
+from cs231n.flat_params import FlatParams
+
+
+# check_accuracy sizes its batches so that a batch of inputs fits in this many
+# bytes. Only the inputs are counted: the activations of a batch grow with the
+# batch size too, and are a model-dependent multiple of the input size, so
+# whether they stay in cache depends on the model. Pass an explicit batch size
+# to bound them.
+EVAL_CACHE_BYTES = 4 * 2 ** 20
 
 
 class Solver(object):
@@ -77,6 +92,10 @@ class Solver(object):
       - loss: Scalar giving the loss
       - grads: Dictionary with the same keys as self.params mapping parameter
         names to gradients of the loss with respect to those parameters.
+
+    - model.inference(X) is optional; if present, check_accuracy calls it
+      instead of model.loss(X) to compute test-time scores, so that it can
+      skip the caches only the backward pass needs.
     """
 
     def __init__(self, model, data, **kwargs):
@@ -86,7 +105,9 @@ class Solver(object):
         Required arguments:
         - model: A model object conforming to the API described above
         - data: A dictionary of training and validation data containing:
-          'X_train': Array, shape (N_train, d_1, ..., d_k) of training images
+          'X_train': Array, shape (N_train, d_1, ..., d_k) of training images;
+            may also be an np.memmap or a data_utils.ChunkedArray for data that
+            does not fit in memory
           'X_val': Array, shape (N_val, d_1, ..., d_k) of validation images
           'y_train': Array, shape (N_train,) of labels for training images
           'y_val': Array, shape (N_val,) of labels for validation images
@@ -100,6 +121,12 @@ class Solver(object):
           'learning_rate' parameter so that should always be present.
         - lr_decay: A scalar for learning rate decay; after each epoch the
           learning rate is multiplied by this value.
+        - lr_schedule: If not None, a schedule from lr_schedule.py, such as
+          CosineSchedule() or WarmupSchedule(OneCycleSchedule()). It is
+          evaluated before every iteration, and the learning rate of all
+          parameters set to the 'learning_rate' of optim_config times its
+          factor, times lr_decay ** epoch. Schedules that watch the
+          validation accuracy, like PlateauSchedule, see every accuracy check.
         - batch_size: Size of minibatches used to compute loss and gradient
           during training.
         - num_epochs: The number of epochs to run for during training.
@@ -111,8 +138,83 @@ class Solver(object):
           accuracy; default is 1000; set to None to use entire training set.
         - num_val_samples: Number of validation samples to use to check val
           accuracy; default is None, which uses the entire validation set.
+        - eval_every: If not None, check train and val accuracy every
+          eval_every iterations instead of at the end of every epoch.
+        - eval_budget: If not None, the largest fraction of the training time
+          to spend checking accuracy; scheduled checks are skipped while the
+          time spent on them exceeds it. The last iteration is always checked.
+        - eval_batch_size: Batch size used to check accuracy; by default the
+          number of examples whose inputs fit in EVAL_CACHE_BYTES.
+        - eval_tolerance: If not None, every accuracy check visits the samples
+          in random order and stops as soon as the standard error of the
+          running accuracy estimate falls below this value.
         - checkpoint_name: If not None, then save model checkpoints here every
           epoch.
+        - checkpoint_format: 'pickle' (the default) pickles the model and the
+          histories. 'npz' writes the parameters, the best parameters and the
+          state of the update rule as raw arrays to one .npz file, on a
+          background thread and atomically, and appends the new history
+          entries to checkpoint_name + '_history.jsonl'; training can be
+          resumed from such a checkpoint with load_checkpoint.
+        - sampling: How training minibatches are drawn. 'replacement' (the
+          default) draws every minibatch independently, with replacement.
+          'epoch' walks a fresh random permutation of the training set every
+          epoch, so that every example is visited once per epoch.
+          'sequential' walks the training set in order, which suits data
+          that is already shuffled; minibatches are then zero-copy slices of
+          X_train unless prefetch or augment_fn is used.
+        - prefetch: If positive, minibatches are drawn by a MinibatchLoader
+          that gathers this many minibatches ahead on a background thread.
+          The loader samples by epoch, or in order if sampling is
+          'sequential'. Default is 0, which gathers every minibatch on the
+          training thread.
+        - augment_fn: If not None, a function applied as augment_fn(X_batch)
+          to every training minibatch; see MinibatchLoader. Implies the
+          MinibatchLoader.
+        - chunk_size: If not None, the MinibatchLoader shuffles chunks of this
+          many consecutive training examples and then the examples within
+          each chunk, so that training data that lives on disk, such as an
+          np.memmap or a ChunkedArray, is read with good locality. Defaults
+          to the chunk_size of X_train if it has one. Implies the
+          MinibatchLoader.
+        - num_workers: If greater than 1, every minibatch is split across this
+          many forked worker processes that run model.loss on their shard
+          while sharing the model parameters; see DataParallel. Requires the
+          fork start method. Default is 1, which computes the loss in this
+          process.
+        - flat_params: Boolean; if true, the model parameters are packed into
+          one contiguous FlatParams buffer, each entry of model.params
+          becoming a view of it, and every step updates all of them with a
+          single call of the update rule on the flat parameter and gradient
+          arrays, with one optim config whose cached values are flat as well.
+          This saves the per-parameter overhead of models with many small
+          parameters. The config also holds the segment offsets of the
+          parameters under '_segments', for layer-wise rules such as lars.
+          Default is False.
+        - micro_batch_size: If not None, every minibatch of batch_size
+          examples is run through the model in micro-batches of this size,
+          and their gradients are averaged, weighted by size, into that of
+          the whole minibatch before the update. This gives large effective
+          batches whose activations still fit in the cache; only batch
+          normalization, which uses the statistics of each micro-batch,
+          behaves differently. With num_workers > 1 it must divide
+          batch_size, and every micro-batch is split across the workers.
+        - compute_dtype: If not None, train in mixed precision: the model
+          computes its forward and backward passes with parameters, and
+          model.dtype, of this dtype, such as np.float32, while the Solver
+          keeps float64 master copies of the parameters in master_params and
+          runs the update rule, and so keeps its state, on those, copying
+          them back into the model after every step. Steps whose gradients
+          are not finite are skipped. At the end of training the model gets
+          its original dtype back. numpy has no float16 matrix products, so
+          np.float16 saves memory but is slower than np.float32.
+        - loss_scale: If not None, the model must have a loss_scale attribute,
+          which multiplies its gradients; they are divided by it again in
+          float64 before the update. A number sets a fixed scale, while
+          'dynamic' starts at 2 ** 15, halves the scale whenever a step is
+          skipped and doubles it after loss_scale_window steps in a row that
+          are not. Requires compute_dtype.
+        - loss_scale_window: See loss_scale; default is 200.
         """
         self.model = model
         self.X_train = data['X_train']
@@ -124,14 +226,31 @@ class Solver(object):
         self.update_rule = kwargs.pop('update_rule', 'sgd')
         self.optim_config = kwargs.pop('optim_config', {})
         self.lr_decay = kwargs.pop('lr_decay', 1.0)
+        self.lr_schedule = kwargs.pop('lr_schedule', None)
         self.batch_size = kwargs.pop('batch_size', 100)
         self.num_epochs = kwargs.pop('num_epochs', 10)
         self.num_train_samples = kwargs.pop('num_train_samples', 1000)
         self.num_val_samples = kwargs.pop('num_val_samples', None)
+        self.eval_every = kwargs.pop('eval_every', None)
+        self.eval_budget = kwargs.pop('eval_budget', None)
+        self.eval_batch_size = kwargs.pop('eval_batch_size', None)
+        self.eval_tolerance = kwargs.pop('eval_tolerance', None)
 
         self.checkpoint_name = kwargs.pop('checkpoint_name', None)
+        self.checkpoint_format = kwargs.pop('checkpoint_format', 'pickle')
         self.print_every = kwargs.pop('print_every', 10)
         self.verbose = kwargs.pop('verbose', True)
+        self.sampling = kwargs.pop('sampling', 'replacement')
+        self.prefetch = kwargs.pop('prefetch', 0)
+        self.augment_fn = kwargs.pop('augment_fn', None)
+        self.chunk_size = kwargs.pop('chunk_size',
+                                     getattr(self.X_train, 'chunk_size', None))
+        self.num_workers = kwargs.pop('num_workers', 1)
+        self.flat_params = kwargs.pop('flat_params', False)
+        self.micro_batch_size = kwargs.pop('micro_batch_size', None)
+        self.compute_dtype = kwargs.pop('compute_dtype', None)
+        self.loss_scale = kwargs.pop('loss_scale', None)
+        self.loss_scale_window = kwargs.pop('loss_scale_window', 200)
 
         # Throw an error if there are extra keyword arguments
         if len(kwargs) > 0:
@@ -144,6 +263,36 @@ class Solver(object):
             raise ValueError('Invalid update_rule "%s"' % self.update_rule)
         self.update_rule = getattr(optim, self.update_rule)
 
+        if (self.lr_schedule is not None and
+                'learning_rate' not in self.optim_config):
+            raise ValueError('lr_schedule requires a learning_rate in '
+                             'optim_config')
+
+        if self.checkpoint_format not in ('pickle', 'npz'):
+            raise ValueError('Invalid checkpoint_format "%s"'
+                             % self.checkpoint_format)
+
+        if self.sampling not in ('replacement', 'epoch', 'sequential'):
+            raise ValueError('Invalid sampling "%s"' % self.sampling)
+
+        if (self.micro_batch_size is not None and self.num_workers > 1 and
+                self.batch_size % self.micro_batch_size != 0):
+            raise ValueError('micro_batch_size %d does not divide batch_size %d'
+                             % (self.micro_batch_size, self.batch_size))
+
+        if (self.compute_dtype is not None and
+                np.dtype(self.compute_dtype).kind != 'f'):
+            raise ValueError('Invalid compute_dtype "%s"' % self.compute_dtype)
+
+        if self.loss_scale is not None:
+            if self.compute_dtype is None:
+                raise ValueError('loss_scale requires compute_dtype')
+            if not hasattr(self.model, 'loss_scale'):
+                raise ValueError('Model has no loss_scale attribute')
+            if (self.loss_scale != 'dynamic' and
+                    not isinstance(self.loss_scale, (int, float))):
+                raise ValueError('Invalid loss_scale "%s"' % self.loss_scale)
+
         self._reset()
 
 
@@ -154,12 +303,58 @@ class Solver(object):
         """
         # Set up some variables for book-keeping
         self.epoch = 0
+        self.loader = None
+        self.parallel = None
+        self._grad_sums = None
+        self._master_grads = None
+        self._good_steps = 0
+        self.skipped_steps = 0
+        self._start_iteration = 0
+        self._loader_seed = None
+        self._checkpoint_thread = None
+        self._checkpoint_error = None
+        self._history_saved = (0, 0)
+        self.eval_time = 0.0
         self.best_val_acc = 0
         self.best_params = {}
         self.loss_history = []
         self.train_acc_history = []
         self.val_acc_history = []
 
+        # Forked workers must see the parameters the model computes with
+        empty = shared_empty if self.num_workers > 1 else np.empty
+
+        # In mixed precision the update rule works on float64 master copies
+        # of the parameters, and the model on a flat copy in compute_dtype.
+        self.master_params = None
+        self.compute_flat = None
+        if self.compute_dtype is not None:
+            self._model_dtypes = (
+                {p: w.dtype for p, w in self.model.params.items()},
+                getattr(self.model, 'dtype', None))
+            self.master_params = {p: np.array(w, dtype=np.float64)
+                                  for p, w in self.model.params.items()}
+            for p, w in list(self.model.params.items()):
+                self.model.params[p] = w.astype(self.compute_dtype)
+            self.compute_flat = FlatParams(self.model.params, empty=empty)
+            if hasattr(self.model, 'dtype'):
+                self.model.dtype = self.compute_dtype
+            if self.loss_scale is not None:
+                if self.loss_scale == 'dynamic':
+                    self.model.loss_scale = 2.0 ** 15
+                else:
+                    self.model.loss_scale = float(self.loss_scale)
+            # Only this process touches the master copies
+            empty = np.empty
+
+        # With flat_params all parameters share one flat optim config
+        self.flat = None
+        if self.flat_params:
+            self.flat = FlatParams(self._params(), empty=empty)
+            self.optim_configs = {'flat': dict(self.optim_config)}
+            self.optim_configs['flat']['_segments'] = self.flat.offsets
+            return
+
         # Make a deep copy of the optim_config for each parameter
         self.optim_configs = {}
         for p in self.model.params:
@@ -173,30 +368,173 @@ class Solver(object):
         be called manually.
         """
         # Make a minibatch of training data
-        num_train = self.X_train.shape[0]
-        batch_mask = np.random.choice(num_train, self.batch_size)
-        X_batch = self.X_train[batch_mask]
-        y_batch = self.y_train[batch_mask]
-
-        # Compute loss and gradient
-        loss, grads = self.model.loss(X_batch, y_batch)
+        if self.loader is not None:
+            X_batch, y_batch = next(self.loader)
+        else:
+            num_train = self.X_train.shape[0]
+            batch_mask = np.random.choice(num_train, self.batch_size)
+            X_batch = self.X_train[batch_mask]
+            y_batch = self.y_train[batch_mask]
+
+        # Compute loss and gradient; overflows under a loss scale are
+        # expected, and their steps are skipped.
+        ignore = 'ignore' if self.loss_scale is not None else None
+        micro = self.micro_batch_size
+        with np.errstate(over=ignore, invalid=ignore):
+            if micro is None or micro >= X_batch.shape[0]:
+                loss, grads = self._loss(X_batch, y_batch)
+            else:
+                loss, grads = self._accumulate(X_batch, y_batch, micro)
         self.loss_history.append(loss)
 
+        if self.master_params is not None:
+            grads = self._unscale_grads(grads)
+            if grads is None:
+                return
+
         # Perform a parameter update
-        for p, w in self.model.params.items():
-            dw = grads[p]
-            config = self.optim_configs[p]
+        params = self._params()
+        if self.flat is not None:
+            w = self.flat.data
+            dw = self.flat.flatten_grads(grads)
+            config = self.optim_configs['flat']
             next_w, next_config = self.update_rule(w, dw, config)
-            self.model.params[p] = next_w
-            self.optim_configs[p] = next_config
+            if next_w is not w:
+                w[...] = next_w
+            self.optim_configs['flat'] = next_config
+        else:
+            for p, w in params.items():
+                dw = grads[p]
+                config = self.optim_configs[p]
+                next_w, next_config = self.update_rule(w, dw, config)
+                if self.parallel is not None and self.master_params is None:
+                    # Write into the shared parameters the workers read
+                    w[...] = next_w
+                else:
+                    params[p] = next_w
+                self.optim_configs[p] = next_config
+
+        if self.master_params is not None:
+            self._copy_to_model()
+
+
+    def _params(self):
+        """
+        Return the parameters the update rule works on: the master copies in
+        mixed precision, otherwise those of the model.
+        """
+        if self.master_params is not None:
+            return self.master_params
+        return self.model.params
 
 
-    def _save_checkpoint(self):
+    def _unscale_grads(self, grads):
+        """
+        Convert the gradients of the model to float64 and divide them by the
+        loss scale. Return them, or None if any is not finite, in which case
+        the step is skipped and a dynamic loss scale is halved.
+        """
+        if self.flat is not None:
+            out = self.flat.grad_views
+            arrays = [self.flat.flatten_grads(grads)]
+        else:
+            if self._master_grads is None:
+                self._master_grads = {p: np.empty_like(w)
+                                      for p, w in self.master_params.items()}
+            out = self._master_grads
+            for p, g in out.items():
+                np.copyto(g, grads[p])
+            arrays = list(out.values())
+
+        scale = getattr(self.model, 'loss_scale', 1.0)
+        finite = True
+        with np.errstate(over='ignore', invalid='ignore'):
+            for g in arrays:
+                if scale != 1:
+                    g /= scale
+                # The sum is not finite if any element is not
+                finite = finite and np.isfinite(np.sum(g))
+
+        if self.loss_scale == 'dynamic':
+            if not finite:
+                self.model.loss_scale = scale / 2
+                self._good_steps = 0
+            else:
+                self._good_steps += 1
+                if self._good_steps == self.loss_scale_window:
+                    self.model.loss_scale = scale * 2
+                    self._good_steps = 0
+        if not finite:
+            self.skipped_steps += 1
+            return None
+        return out
+
+
+    def _copy_to_model(self):
+        """
+        Copy the master parameters into the parameters of the model, in
+        compute_dtype.
+        """
+        if self.flat is not None:
+            np.copyto(self.compute_flat.data, self.flat.data,
+                      casting='same_kind')
+        else:
+            for p, w in self.master_params.items():
+                np.copyto(self.model.params[p], w, casting='same_kind')
+
+
+    def _loss(self, X_batch, y_batch):
+        """
+        Compute the loss and gradients of a minibatch, on the workers if
+        num_workers > 1.
+        """
+        if self.num_workers > 1:
+            if self.parallel is None:
+                params = self.flat
+                if self.master_params is not None:
+                    params = self.compute_flat
+                self.parallel = DataParallel(self.model, self.num_workers,
+                                             X_batch, y_batch, params=params)
+            loss, grads = self.parallel.loss(X_batch, y_batch)
+        else:
+            loss, grads = self.model.loss(X_batch, y_batch)
+        return loss, grads
+
+
+    def _accumulate(self, X_batch, y_batch, micro_batch_size):
+        """
+        Compute the loss and gradients of a minibatch as the size-weighted
+        average of those of its micro-batches.
+        """
+        N = X_batch.shape[0]
+        if self._grad_sums is None:
+            self._grad_sums = {p: np.empty_like(w)
+                               for p, w in self._params().items()}
+        loss = 0.0
+        for start in range(0, N, micro_batch_size):
+            end = min(start + micro_batch_size, N)
+            weight = (end - start) / N
+            micro_loss, micro_grads = self._loss(X_batch[start:end],
+                                                 y_batch[start:end])
+            loss += weight * micro_loss
+            for p, g in self._grad_sums.items():
+                if start == 0:
+                    np.multiply(micro_grads[p], weight, out=g)
+                else:
+                    g += weight * micro_grads[p]
+        return loss, self._grad_sums
+
+
+    def _save_checkpoint(self, iteration=None):
         if self.checkpoint_name is None: return
+        if self.checkpoint_format == 'npz':
+            self._save_npz_checkpoint(iteration)
+            return
         checkpoint = {
           'model': self.model,
           'update_rule': self.update_rule,
           'lr_decay': self.lr_decay,
+          'lr_schedule': self.lr_schedule,
           'optim_config': self.optim_config,
           'batch_size': self.batch_size,
           'num_train_samples': self.num_train_samples,
@@ -213,7 +551,181 @@ class Solver(object):
             pickle.dump(checkpoint, f)
 
 
-    def check_accuracy(self, X, y, num_samples=None, batch_size=100):
+    def _save_npz_checkpoint(self, iteration):
+        """
+        Snapshot the training state after the given number of iterations and
+        write it on a background thread.
+        """
+        # Copy everything now, since training goes on while it is written
+        arrays = {}
+        for p, w in self._params().items():
+            arrays['param/' + p] = np.array(w)
+        for p, w in self.best_params.items():
+            arrays['best/' + p] = np.array(w)
+        for p, config in self.optim_configs.items():
+            for k, v in config.items():
+                if not k.startswith('_'):  # scratch space of the update rule
+                    arrays['optim/%s/%s' % (p, k)] = np.array(v)
+        for i, bn_param in enumerate(getattr(self.model, 'bn_params', None) or []):
+            for k, v in bn_param.items():
+                if isinstance(v, np.ndarray):
+                    arrays['bn/%d/%s' % (i, k)] = v.copy()
+        random_state = np.random.get_state()
+        arrays['random/keys'] = random_state[1].copy()
+        history_file = self.checkpoint_name + '_history.jsonl'
+        meta = {
+          'iteration': iteration,
+          'epoch': self.epoch,
+          'best_val_acc': float(self.best_val_acc),
+          'update_rule': self.update_rule.__name__,
+          'lr_schedule': (self.lr_schedule.state()
+                          if self.lr_schedule is not None else None),
+          'loss_scale': getattr(self.model, 'loss_scale', None),
+          'good_steps': self._good_steps,
+          'random_state': [random_state[0], int(random_state[2]),
+                           int(random_state[3]), float(random_state[4])],
+          'loader_seed': self._loader_seed,
+          'history_file': os.path.basename(history_file),
+          'history_lengths': [len(self.loss_history),
+                              len(self.train_acc_history)],
+        }
+        arrays['meta'] = np.array(json.dumps(meta))
+
+        # Only the history entries added since the last checkpoint are
+        # written; the first checkpoint of a new run starts a new file.
+        num_losses, num_accs = self._history_saved
+        history_mode = 'a' if num_losses or num_accs else 'w'
+        record = {
+          'iteration': iteration,
+          'epoch': self.epoch,
+          'loss_history': [float(x) for x in self.loss_history[num_losses:]],
+          'train_acc_history': [float(x) for x in
+                                self.train_acc_history[num_accs:]],
+          'val_acc_history': [float(x) for x in self.val_acc_history[num_accs:]],
+        }
+        self._history_saved = tuple(meta['history_lengths'])
+
+        filename = '%s_epoch_%d.npz' % (self.checkpoint_name, self.epoch)
+        if self.verbose:
+            print('Saving checkpoint to "%s"' % filename)
+        self._wait_checkpoint()
+        self._checkpoint_thread = threading.Thread(
+            target=self._write_npz_checkpoint,
+            args=(filename, arrays, history_file, history_mode, record))
+        self._checkpoint_thread.start()
+
+
+    def _write_npz_checkpoint(self, filename, arrays, history_file,
+                              history_mode, record):
+        try:
+            with atomic_path(filename) as tmp_filename:
+                with open(tmp_filename, 'wb') as f:
+                    np.savez(f, **arrays)
+            with open(history_file, history_mode) as f:
+                f.write(json.dumps(record) + '\n')
+        except Exception as e:
+            self._checkpoint_error = e
+
+
+    def _wait_checkpoint(self):
+        """
+        Wait for the checkpoint being written, re-raising any error.
+        """
+        if self._checkpoint_thread is not None:
+            self._checkpoint_thread.join()
+            self._checkpoint_thread = None
+        if self._checkpoint_error is not None:
+            error, self._checkpoint_error = self._checkpoint_error, None
+            raise error
+
+
+    def load_checkpoint(self, filename):
+        """
+        Restore the model parameters, the state of the update rule and the
+        histories from a checkpoint written with checkpoint_format='npz', so
+        that the next call to train() resumes at the iteration after it.
+        The Solver must be constructed with the same update_rule, batch_size
+        and flat_params as the one that wrote the checkpoint.
+
+        The state of np.random and the seed and position of the minibatch
+        loader are restored too, so that, with any sampling, the resumed run
+        draws the same minibatches, dropout masks and accuracy subsamples as
+        an uninterrupted one. Randomness that does not come from np.random on
+        the training thread, such as that of an augment_fn run on the
+        prefetch thread or of dropout in the worker processes of
+        num_workers > 1, is not restored.
+        """
+        with np.load(filename) as f:
+            meta = json.loads(str(f['meta']))
+            if meta['update_rule'] != self.update_rule.__name__:
+                raise ValueError('Checkpoint was written with update_rule "%s"'
+                                 % meta['update_rule'])
+            self.best_params = {}
+            random_keys = None
+            for key in f.files:
+                kind, _, name = key.partition('/')
+                if kind == 'param':
+                    if self.flat is not None:
+                        self._params()[name][...] = f[key]
+                    else:
+                        self._params()[name] = f[key]
+                elif kind == 'best':
+                    self.best_params[name] = f[key]
+                elif kind == 'optim':
+                    p, k = name.rsplit('/', 1)
+                    v = f[key]
+                    self.optim_configs[p][k] = v.item() if v.ndim == 0 else v
+                elif kind == 'bn':
+                    i, k = name.split('/', 1)
+                    self.model.bn_params[int(i)][k] = f[key]
+                elif kind == 'random':
+                    random_keys = f[key]
+
+        self.epoch = meta['epoch']
+        self.best_val_acc = meta['best_val_acc']
+        if self.lr_schedule is not None and meta.get('lr_schedule'):
+            self.lr_schedule.load_state(meta['lr_schedule'])
+        if self.loss_scale is not None and meta.get('loss_scale') is not None:
+            self.model.loss_scale = meta['loss_scale']
+        if self.master_params is not None:
+            self._copy_to_model()
+        self._good_steps = meta.get('good_steps', 0)
+        if random_keys is not None:
+            name, pos, has_gauss, cached_gaussian = meta['random_state']
+            np.random.set_state((name, random_keys, pos, has_gauss,
+                                 cached_gaussian))
+        self._loader_seed = meta.get('loader_seed')
+        self._start_iteration = meta['iteration']
+
+        # Rebuild the histories, dropping entries written after the
+        # checkpoint by a run that was interrupted later on.
+        history_file = os.path.join(os.path.dirname(filename),
+                                    meta['history_file'])
+        records = []
+        with open(history_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record['iteration'] <= meta['iteration']:
+                    records.append(record)
+        num_losses, num_accs = meta['history_lengths']
+        self.loss_history = sum([r['loss_history'] for r in records], [])
+        self.train_acc_history = sum([r['train_acc_history'] for r in records], [])
+        self.val_acc_history = sum([r['val_acc_history'] for r in records], [])
+        del self.loss_history[num_losses:]
+        del self.train_acc_history[num_accs:]
+        del self.val_acc_history[num_accs:]
+        self._history_saved = (num_losses, num_accs)
+        with atomic_path(history_file) as tmp_history_file:
+            with open(tmp_history_file, 'w') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+
+
+    def check_accuracy(self, X, y, num_samples=None, batch_size=None,
+                       tolerance=None):
         """
         Check accuracy of the model on the provided data.
 
@@ -223,7 +735,12 @@ class Solver(object):
         - num_samples: If not None, subsample the data and only test the model
           on num_samples datapoints.
         - batch_size: Split X and y into batches of this size to avoid using
-          too much memory.
+          too much memory. Defaults to the number of examples whose inputs fit
+          in EVAL_CACHE_BYTES; the activations of such a batch are not
+          counted and may be several times larger.
+        - tolerance: If not None, visit the data in random order and stop as
+          soon as the standard error of the running accuracy falls below
+          tolerance.
 
         Returns:
         - acc: Scalar giving the fraction of instances that were correctly
@@ -233,23 +750,46 @@ class Solver(object):
         # Maybe subsample the data
         N = X.shape[0]
         if num_samples is not None and N > num_samples:
-            mask = np.random.choice(N, num_samples)
+            # Sorting the sample does not change the accuracy but reads
+            # memory-mapped data front to back.
+            mask = np.sort(np.random.choice(N, num_samples))
             N = num_samples
             X = X[mask]
             y = y[mask]
 
-        # Compute predictions in batches
-        num_batches = N // batch_size
-        if N % batch_size != 0:
-            num_batches += 1
-        y_pred = []
-        for i in range(num_batches):
-            start = i * batch_size
-            end = (i + 1) * batch_size
-            scores = self.model.loss(X[start:end])
-            y_pred.append(np.argmax(scores, axis=1))
-        y_pred = np.hstack(y_pred)
-        acc = np.mean(y_pred == y)
+        if batch_size is None:
+            row_bytes = np.dtype(X.dtype).itemsize * int(np.prod(X.shape[1:]))
+            batch_size = max(1, EVAL_CACHE_BYTES // max(row_bytes, 1))
+        order = None
+        if tolerance is not None:
+            order = np.random.permutation(N)
+        scores_fn = getattr(self.model, 'inference', None) or self.model.loss
+
+        # Count correct predictions batch by batch
+        num_correct = 0
+        num_seen = 0
+        for start in range(0, N, batch_size):
+            end = min(start + batch_size, N)
+            if order is None:
+                X_batch, y_batch = X[start:end], y[start:end]
+            else:
+                idx = np.sort(order[start:end])
+                X_batch, y_batch = X[idx], y[idx]
+            scores = scores_fn(X_batch)
+            num_correct += int(np.sum(np.argmax(scores, axis=1) == y_batch))
+            num_seen = end
+
+            if tolerance is not None and num_seen < N:
+                # Standard error of the accuracy of a sample of num_seen out
+                # of N; the smoothed estimate avoids stopping on a first
+                # batch that is all right or all wrong.
+                p = (num_correct + 1.0) / (num_seen + 2.0)
+                stderr = np.sqrt(p * (1 - p) / num_seen *
+                                 (N - num_seen) / (N - 1.0))
+                if stderr <= tolerance:
+                    break
+
+        acc = num_correct / float(num_seen)
 
         return acc
 
@@ -262,7 +802,58 @@ class Solver(object):
         iterations_per_epoch = max(num_train // self.batch_size, 1)
         num_iterations = self.num_epochs * iterations_per_epoch
 
-        for t in range(num_iterations):
+        if (self.sampling != 'replacement' or self.prefetch > 0 or
+                self.augment_fn is not None or self.chunk_size is not None):
+            # A resumed run continues the loader of the checkpointed one
+            if self._loader_seed is None:
+                self._loader_seed = np.random.randint(2 ** 31)
+            self.loader = MinibatchLoader(self.X_train, self.y_train,
+                                          batch_size=self.batch_size,
+                                          prefetch=self.prefetch,
+                                          augment_fn=self.augment_fn,
+                                          shuffle=self.sampling != 'sequential',
+                                          chunk_size=self.chunk_size,
+                                          seed=self._loader_seed,
+                                          start=self._start_iteration)
+        try:
+            self._train_loop(num_iterations, iterations_per_epoch)
+            self._start_iteration = 0
+            self._loader_seed = None
+        finally:
+            if self.loader is not None:
+                self.loader.close()
+                self.loader = None
+            if self.parallel is not None:
+                self.parallel.close()
+                self.parallel = None
+            self._wait_checkpoint()
+
+        # At the end of training swap the best params into the model
+        if self.master_params is not None:
+            # Hand the model back in the precision it came in
+            param_dtypes, model_dtype = self._model_dtypes
+            self.model.params = {p: w.astype(param_dtypes[p])
+                                 for p, w in self.best_params.items()}
+            if hasattr(self.model, 'dtype'):
+                self.model.dtype = model_dtype
+            if hasattr(self.model, 'loss_scale'):
+                self.model.loss_scale = 1.0
+        elif self.flat is not None:
+            self.flat.load(self.best_params)
+        else:
+            self.model.params = self.best_params
+
+
+    def _train_loop(self, num_iterations, iterations_per_epoch):
+        train_start = time.time()
+        for t in range(self._start_iteration, num_iterations):
+            # Set the learning rate of this iteration
+            if self.lr_schedule is not None:
+                lr = (self.optim_config['learning_rate'] *
+                      self.lr_decay ** self.epoch *
+                      self.lr_schedule(t, num_iterations, iterations_per_epoch))
+                for k in self.optim_configs:
+                    self.optim_configs[k]['learning_rate'] = lr
             self._step()
 
             # Maybe print training loss
@@ -271,36 +862,51 @@ class Solver(object):
                        t + 1, num_iterations, self.loss_history[-1]))
 
             # At the end of every epoch, increment the epoch counter and decay
-            # the learning rate.
+            # the learning rate; an lr_schedule applies lr_decay itself.
             epoch_end = (t + 1) % iterations_per_epoch == 0
             if epoch_end:
                 self.epoch += 1
-                for k in self.optim_configs:
-                    self.optim_configs[k]['learning_rate'] *= self.lr_decay
+                if self.lr_schedule is None:
+                    for k in self.optim_configs:
+                        self.optim_configs[k]['learning_rate'] *= self.lr_decay
 
             # Check train and val accuracy on the first iteration, the last
-            # iteration, and at the end of each epoch.
+            # iteration, and at the end of each epoch or every eval_every
+            # iterations, within the time budget.
             first_it = (t == 0)
             last_it = (t == num_iterations - 1)
-            if first_it or last_it or epoch_end:
+            if self.eval_every is not None:
+                scheduled = (t + 1) % self.eval_every == 0
+            else:
+                scheduled = epoch_end
+            if scheduled and self.eval_budget is not None:
+                elapsed = time.time() - train_start
+                scheduled = self.eval_time <= self.eval_budget * elapsed
+            if first_it or last_it or scheduled:
+                eval_start = time.time()
                 train_acc = self.check_accuracy(self.X_train, self.y_train,
-                    num_samples=self.num_train_samples)
+                    num_samples=self.num_train_samples,
+                    batch_size=self.eval_batch_size,
+                    tolerance=self.eval_tolerance)
                 val_acc = self.check_accuracy(self.X_val, self.y_val,
-                    num_samples=self.num_val_samples)
+                    num_samples=self.num_val_samples,
+                    batch_size=self.eval_batch_size,
+                    tolerance=self.eval_tolerance)
+                self.eval_time += time.time() - eval_start
                 self.train_acc_history.append(train_acc)
                 self.val_acc_history.append(val_acc)
-                self._save_checkpoint()
+                if self.lr_schedule is not None:
+                    self.lr_schedule.observe(val_acc)
 
                 if self.verbose:
                     print('(Epoch %d / %d) train acc: %f; val_acc: %f' % (
                            self.epoch, self.num_epochs, train_acc, val_acc))
 
-                # Keep track of the best model
+                # Keep track of the best model, before checkpointing so that
+                # a resumed run knows about it
                 if val_acc > self.best_val_acc:
                     self.best_val_acc = val_acc
                     self.best_params = {}
-                    for k, v in self.model.params.items():
+                    for k, v in self._params().items():
                         self.best_params[k] = v.copy()
-
-        # At the end of training swap the best params into the model
-        self.model.params = self.best_params
+                self._save_checkpoint(t + 1)
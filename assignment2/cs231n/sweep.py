@@ -0,0 +1,385 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+import copy
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import time
+import traceback
+
+import numpy as np
+
+from cs231n.file_utils import atomic_path
+from cs231n.solver import Solver
+
+
+def grid_configs(space):
+    """
+    Return every combination of the values in space.
+
+    Inputs:
+    - space: Dictionary mapping hyperparameter names to lists of values.
+
+    Returns:
+    - configs: List of dictionaries mapping every name to one of its values;
+      numpy scalars, as found in arrays of values, become Python scalars so
+      that the configurations can be saved as JSON.
+    """
+    names = list(space)
+    configs = []
+    for values in itertools.product(*[space[k] for k in names]):
+        values = [v.item() if isinstance(v, np.generic) else v for v in values]
+        configs.append(dict(zip(names, values)))
+    return configs
+
+
+def log_uniform(low, high):
+    """
+    Return a sampler for random_configs drawing log-uniformly from [low, high].
+    """
+    def sample(rng):
+        return float(10 ** rng.uniform(np.log10(low), np.log10(high)))
+    return sample
+
+
+def uniform(low, high):
+    """
+    Return a sampler for random_configs drawing uniformly from [low, high].
+    """
+    def sample(rng):
+        return float(rng.uniform(low, high))
+    return sample
+
+
+def random_configs(space, num_trials, seed=0):
+    """
+    Return num_trials random configurations drawn from space.
+
+    Inputs:
+    - space: Dictionary mapping hyperparameter names to either a list of
+      values, one of which is chosen uniformly, or a function that takes a
+      np.random.RandomState and returns a value, such as log_uniform(1e-4, 1e-2).
+    - num_trials: Number of configurations to draw.
+    - seed: Seed of the random number generator; the same seed gives the same
+      configurations, so an interrupted sweep can be resumed.
+
+    Returns:
+    - configs: List of dictionaries mapping every name to a value.
+    """
+    rng = np.random.RandomState(seed)
+    configs = []
+    for _ in range(num_trials):
+        config = {}
+        for name, values in space.items():
+            if callable(values):
+                config[name] = values(rng)
+            else:
+                config[name] = values[rng.randint(len(values))]
+                if isinstance(config[name], np.generic):
+                    config[name] = config[name].item()
+        configs.append(config)
+    return configs
+
+
+def array_digest(a):
+    """
+    Return a hash of the shape, dtype and contents of an array.
+    """
+    a = np.ascontiguousarray(a)
+    h = hashlib.sha1(json.dumps([a.shape, a.dtype.str]).encode())
+    h.update(a.data)
+    return h.hexdigest()[:16]
+
+
+def memmap_data(data, data_dir, digests=None):
+    """
+    Save every array in data to data_dir as a .npy file, once, and return a
+    dictionary of read-only memory maps of them, which any number of
+    processes can share through the page cache.
+
+    The files are named by the key and the array_digest of the array, so
+    changed data is never served from a stale file; older files of the same
+    key are removed. digests, if given, maps the keys to the digests of their
+    arrays, which are then not hashed again.
+    """
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    if digests is None:
+        digests = {k: array_digest(v) for k, v in data.items()}
+    shared = {}
+    for k, v in data.items():
+        v = np.ascontiguousarray(v)
+        name = '%s_%s.npy' % (k, digests[k])
+        path = os.path.join(data_dir, name)
+        if not os.path.isfile(path):
+            with atomic_path(path) as tmp_path:
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, v)
+        stale = re.compile(r'%s_[0-9a-f]{16}\.npy$' % re.escape(k))
+        for f in os.listdir(data_dir):
+            if f != name and stale.match(f):
+                os.remove(os.path.join(data_dir, f))
+        shared[k] = np.load(path, mmap_mode='r')
+    return shared
+
+
+def _json_default(obj):
+    """
+    Describe an object that json cannot serialize by a stable value: numpy
+    scalars and arrays by their values, functions by their qualified names
+    and arguments bound with functools.partial, and other objects by their
+    class and attributes.
+    """
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    if isinstance(obj, functools.partial):
+        return [obj.func, obj.args, obj.keywords]
+    if hasattr(obj, '__qualname__'):
+        return '%s.%s' % (getattr(obj, '__module__', None), obj.__qualname__)
+    if hasattr(obj, '__dict__'):
+        return [type(obj).__name__, vars(obj)]
+    return repr(obj)
+
+
+def trial_id(config, num_epochs, solver_kwargs=None, digests=None):
+    """
+    Return a stable identifier of training config for num_epochs epochs with
+    the Solver keyword arguments solver_kwargs shared by the whole sweep, on
+    the data whose arrays have the array_digest values in digests.
+    """
+    key = json.dumps([config, num_epochs, solver_kwargs or {}, digests or {}],
+                     sort_keys=True, default=_json_default)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+# Set in every worker of the pool by _init_sweep_worker; inherited through fork.
+_sweep_worker_state = None
+
+
+def _init_sweep_worker(make_trial, data, solver_kwargs):
+    global _sweep_worker_state
+    _sweep_worker_state = (make_trial, data, solver_kwargs)
+
+
+def _sweep_worker_trial(args):
+    return _run_trial(*(_sweep_worker_state + args))
+
+
+def _run_trial(make_trial, data, solver_kwargs, tid, config, num_epochs, rung):
+    """
+    Train one model and return the record of the trial with id tid.
+    """
+    record = {'trial_id': tid, 'config': config, 'num_epochs': num_epochs,
+              'rung': rung}
+    start = time.time()
+    try:
+        # Seed from the trial id, so results do not depend on scheduling
+        np.random.seed(int(tid[:8], 16))
+        model, kwargs = make_trial(config)
+        # A copy, so that stateful arguments such as an lr_schedule start
+        # afresh in every trial
+        all_kwargs = copy.deepcopy(solver_kwargs)
+        all_kwargs.update(kwargs)
+        all_kwargs['num_epochs'] = num_epochs
+        solver = Solver(model, data, **all_kwargs)
+        solver.train()
+        record.update({
+          'loss_history': [float(x) for x in solver.loss_history],
+          'train_acc_history': [float(x) for x in solver.train_acc_history],
+          'val_acc_history': [float(x) for x in solver.val_acc_history],
+          'best_val_acc': float(solver.best_val_acc),
+        })
+    except Exception:
+        record['error'] = traceback.format_exc()
+        record['best_val_acc'] = None
+    record['wall_time'] = time.time() - start
+    return record
+
+
+class Sweep(object):
+    """
+    A Sweep trains one model per hyperparameter configuration with Solver,
+    running the trials on a pool of forked worker processes that share one
+    copy of the dataset.
+
+    Every finished trial is appended as one line of JSON to results_file,
+    holding its configuration, the loss and accuracy histories of its Solver,
+    its best validation accuracy and its wall time. Trials already recorded
+    there, with the same configuration, number of epochs, solver_kwargs and
+    data, are not run again, so an interrupted sweep is resumed simply by
+    running it again with the same arguments.
+
+    Example usage:
+
+    def make_trial(config):
+        model = FullyConnectedNet([config['hidden_dim']], reg=config['reg'])
+        solver_kwargs = {
+          'optim_config': {'learning_rate': config['learning_rate']},
+        }
+        return model, solver_kwargs
+
+    space = {
+      'learning_rate': log_uniform(1e-4, 1e-2),
+      'reg': log_uniform(1e-5, 1e-1),
+      'hidden_dim': [50, 100, 200],
+    }
+    sweep = Sweep(make_trial, data, results_file='sweep.jsonl', n_jobs=4,
+                  data_dir='cs231n/datasets/sweep_data',
+                  update_rule='adam', batch_size=200)
+    results = sweep.run_halving(random_configs(space, 27), min_epochs=1)
+    best = max(results, key=lambda r: r['best_val_acc'])
+    """
+
+    def __init__(self, make_trial, data, results_file=None, n_jobs=1,
+                 data_dir=None, verbose=True, **solver_kwargs):
+        """
+        Inputs:
+        - make_trial: Function called as make_trial(config) in the worker that
+          runs a trial; returns a tuple (model, kwargs) of the model to train
+          and the Solver keyword arguments specific to config.
+        - data: Dictionary of training and validation data, as for Solver.
+        - results_file: If not None, path of the JSON lines file that trial
+          records are appended to and resumed from.
+        - n_jobs: Number of worker processes; 1 runs every trial in this
+          process.
+        - data_dir: If not None, the arrays of data are saved here and memory-
+          mapped (see memmap_data), so that all workers share them.
+        - verbose: Boolean; if true, print a line per finished trial. The
+          Solvers themselves run with verbose=False.
+        - solver_kwargs: Keyword arguments passed to every Solver, such as
+          update_rule or batch_size. make_trial may override them;
+          num_epochs is set by the sweep.
+        """
+        if n_jobs > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            raise ValueError('Sweep needs the fork start method for n_jobs > 1, '
+                             'which is not available on this platform')
+        self.digests = {k: array_digest(v) for k, v in data.items()}
+        if data_dir is not None:
+            data = memmap_data(data, data_dir, self.digests)
+        self.make_trial = make_trial
+        self.data = data
+        self.results_file = results_file
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.solver_kwargs = solver_kwargs
+        self.solver_kwargs['verbose'] = False
+
+    def load_results(self):
+        """
+        Return a dictionary mapping trial ids to the records in results_file.
+        """
+        results = {}
+        if self.results_file is None or not os.path.isfile(self.results_file):
+            return results
+        with open(self.results_file, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by an interruption
+                results[record['trial_id']] = record
+        return results
+
+    def _record(self, record):
+        if self.results_file is not None:
+            with open(self.results_file, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        if self.verbose:
+            if 'error' in record:
+                print('Trial %s failed after %.1fs: %s' % (
+                      record['trial_id'], record['wall_time'],
+                      record['error'].strip().splitlines()[-1]))
+            else:
+                print('Trial %s, %d epochs: best val acc %f (%.1fs) %r' % (
+                      record['trial_id'], record['num_epochs'],
+                      record['best_val_acc'], record['wall_time'],
+                      record['config']))
+
+    def _run_trials(self, configs, num_epochs, rung=0):
+        """
+        Run a trial of num_epochs epochs for every configuration, skipping
+        those already in results_file, and return their records in order.
+        """
+        done = self.load_results()
+        ids = [trial_id(config, num_epochs, self.solver_kwargs, self.digests)
+               for config in configs]
+        todo = [(tid, config, num_epochs, rung)
+                for config, tid in zip(configs, ids) if tid not in done]
+        if self.verbose and len(todo) < len(configs):
+            print('Resuming: %d of %d trials already done' % (
+                  len(configs) - len(todo), len(configs)))
+
+        if self.n_jobs == 1 or len(todo) <= 1:
+            for args in todo:
+                record = _run_trial(self.make_trial, self.data,
+                                    self.solver_kwargs, *args)
+                self._record(record)
+                done[record['trial_id']] = record
+        else:
+            # Workers inherit the dataset and make_trial through fork instead
+            # of receiving pickled copies.
+            ctx = multiprocessing.get_context('fork')
+            pool = ctx.Pool(min(self.n_jobs, len(todo)),
+                            initializer=_init_sweep_worker,
+                            initargs=(self.make_trial, self.data,
+                                      self.solver_kwargs))
+            try:
+                for record in pool.imap_unordered(_sweep_worker_trial, todo):
+                    self._record(record)
+                    done[record['trial_id']] = record
+            finally:
+                pool.close()
+                pool.join()
+        return [done[tid] for tid in ids]
+
+    def run(self, configs, num_epochs=10):
+        """
+        Train every configuration for num_epochs epochs, as for a grid or
+        random search.
+
+        Returns:
+        - results: List of trial records, one per configuration, in order.
+        """
+        return self._run_trials(configs, num_epochs)
+
+    def run_halving(self, configs, min_epochs=1, eta=3, max_epochs=None):
+        """
+        Successive halving: train every configuration for min_epochs epochs,
+        keep the best 1 / eta of them by best validation accuracy, train
+        those for eta times as many epochs, and so on until one
+        configuration is left or max_epochs would be exceeded. Every round
+        trains its survivors from scratch with the larger budget.
+
+        Returns:
+        - results: List of the trial records of all rounds; the record of
+          each round has a rung field counting the rounds from 0.
+        """
+        results = []
+        survivors = list(configs)
+        num_epochs = min_epochs
+        rung = 0
+        while True:
+            rung_results = self._run_trials(survivors, num_epochs, rung)
+            results.extend(rung_results)
+            if len(survivors) == 1:
+                break
+            if max_epochs is not None and num_epochs * eta > max_epochs:
+                break
+            scores = [r['best_val_acc'] if r['best_val_acc'] is not None
+                      else -np.inf for r in rung_results]
+            keep = max(1, len(survivors) // eta)
+            order = np.argsort(scores, kind='mergesort')[::-1][:keep]
+            survivors = [survivors[i] for i in sorted(order)]
+            num_epochs *= eta
+            rung += 1
+        return results
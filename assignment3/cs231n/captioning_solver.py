@@ -5,6 +5,7 @@ import numpy as np
 
 from cs231n import optim
 from cs231n.coco_utils import sample_coco_minibatch
+from cs231n.lr_schedule import PlateauSchedule, WarmupSchedule
 
 
 class CaptioningSolver(object):
@@ -81,6 +82,12 @@ class CaptioningSolver(object):
           'learning_rate' parameter so that should always be present.
         - lr_decay: A scalar for learning rate decay; after each epoch the learning
           rate is multiplied by this value.
+        - lr_schedule: If not None, a schedule from lr_schedule.py, such as
+          CosineSchedule() or WarmupSchedule(OneCycleSchedule()). It is evaluated
+          before every iteration, and the learning rate of all parameters set to
+          the 'learning_rate' of optim_config times its factor, times
+          lr_decay ** epoch. The CaptioningSolver never checks validation
+          accuracy, so PlateauSchedule, alone or warmed up, is rejected.
         - batch_size: Size of minibatches used to compute loss and gradient during
           training.
         - num_epochs: The number of epochs to run for during training.
@@ -96,6 +103,7 @@ class CaptioningSolver(object):
         self.update_rule = kwargs.pop('update_rule', 'sgd')
         self.optim_config = kwargs.pop('optim_config', {})
         self.lr_decay = kwargs.pop('lr_decay', 1.0)
+        self.lr_schedule = kwargs.pop('lr_schedule', None)
         self.batch_size = kwargs.pop('batch_size', 100)
         self.num_epochs = kwargs.pop('num_epochs', 10)
 
@@ -113,6 +121,17 @@ class CaptioningSolver(object):
             raise ValueError('Invalid update_rule "%s"' % self.update_rule)
         self.update_rule = getattr(optim, self.update_rule)
 
+        if (self.lr_schedule is not None and
+                'learning_rate' not in self.optim_config):
+            raise ValueError('lr_schedule requires a learning_rate in '
+                             'optim_config')
+        schedule = self.lr_schedule
+        while isinstance(schedule, WarmupSchedule):
+            schedule = schedule.schedule
+        if isinstance(schedule, PlateauSchedule):
+            raise ValueError('CaptioningSolver does not check validation '
+                             'accuracy, so PlateauSchedule would never decay')
+
         self._reset()
 
 
@@ -212,6 +231,13 @@ class CaptioningSolver(object):
         num_iterations = self.num_epochs * iterations_per_epoch
 
         for t in range(num_iterations):
+            # Set the learning rate of this iteration
+            if self.lr_schedule is not None:
+                lr = (self.optim_config['learning_rate'] *
+                      self.lr_decay ** self.epoch *
+                      self.lr_schedule(t, num_iterations, iterations_per_epoch))
+                for k in self.optim_configs:
+                    self.optim_configs[k]['learning_rate'] = lr
             self._step()
 
             # Maybe print training loss
@@ -220,12 +246,13 @@ class CaptioningSolver(object):
                        t + 1, num_iterations, self.loss_history[-1]))
 
             # At the end of every epoch, increment the epoch counter and decay the
-            # learning rate.
+            # learning rate; an lr_schedule applies lr_decay itself.
             epoch_end = (t + 1) % iterations_per_epoch == 0
             if epoch_end:
                 self.epoch += 1
-                for k in self.optim_configs:
-                    self.optim_configs[k]['learning_rate'] *= self.lr_decay
+                if self.lr_schedule is None:
+                    for k in self.optim_configs:
+                        self.optim_configs[k]['learning_rate'] *= self.lr_decay
 
             # Check train and val accuracy on the first iteration, the last
             # iteration, and at the end of each epoch.
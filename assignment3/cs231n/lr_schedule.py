@@ -0,0 +1,191 @@
+from __future__ import print_function, division
+from builtins import object
+import math
+
+"""
+This file implements learning rate schedules for the solvers. A schedule gives
+the factor by which the base learning rate, the 'learning_rate' of the
+optim_config, is multiplied at every iteration; the solver evaluates it once
+per iteration and writes the result into the optim configs of all parameters.
+Every schedule has the same interface:
+
+factor = schedule(t, num_iterations, iterations_per_epoch)
+
+Inputs:
+  - t: Index of the iteration about to be run, starting from 0.
+  - num_iterations: Total number of iterations of the training run.
+  - iterations_per_epoch: Number of iterations per epoch.
+
+Returns:
+  - factor: Scalar multiplier of the base learning rate.
+
+Schedules that adapt to the validation accuracy are told about every accuracy
+check through schedule.observe(val_acc); state() and load_state() return and
+restore any state they keep, as a dictionary of JSON-serializable values, so
+that checkpoints can save it.
+"""
+
+
+class LRSchedule(object):
+    """
+    A constant learning rate; the base class of all schedules.
+    """
+
+    def __call__(self, t, num_iterations, iterations_per_epoch):
+        return 1.0
+
+    def observe(self, val_acc):
+        pass
+
+    def state(self):
+        return {}
+
+    def load_state(self, state):
+        pass
+
+
+class StepSchedule(LRSchedule):
+    """
+    Multiplies the learning rate by gamma every step_epochs epochs, or at each
+    of a list of epochs.
+
+    Inputs:
+    - step_epochs: Number of epochs between decays, or a list of the epochs
+      at which to decay.
+    - gamma: Decay factor.
+    """
+
+    def __init__(self, step_epochs, gamma=0.1):
+        self.step_epochs = step_epochs
+        self.gamma = gamma
+
+    def __call__(self, t, num_iterations, iterations_per_epoch):
+        epoch = t // iterations_per_epoch
+        if isinstance(self.step_epochs, (list, tuple)):
+            num_steps = sum(1 for e in self.step_epochs if epoch >= e)
+        else:
+            num_steps = epoch // self.step_epochs
+        return self.gamma ** num_steps
+
+
+class CosineSchedule(LRSchedule):
+    """
+    Anneals the learning rate from the base learning rate to min_factor times
+    it along half a cosine over the whole training run.
+    """
+
+    def __init__(self, min_factor=0.0):
+        self.min_factor = min_factor
+
+    def __call__(self, t, num_iterations, iterations_per_epoch):
+        progress = t / max(num_iterations - 1, 1)
+        return self.min_factor + (1 - self.min_factor) * 0.5 * (
+            1 + math.cos(math.pi * progress))
+
+
+class OneCycleSchedule(LRSchedule):
+    """
+    The one-cycle policy: the learning rate rises from the base learning rate
+    divided by div_factor to the base learning rate over the first pct_start
+    of the training run, then anneals to the initial learning rate divided by
+    final_div_factor over the rest, both along half a cosine. The base
+    learning rate is thus the peak one, and can usually be set several times
+    higher than for a constant learning rate.
+    """
+
+    def __init__(self, pct_start=0.3, div_factor=25.0, final_div_factor=1e4):
+        self.pct_start = pct_start
+        self.div_factor = div_factor
+        self.final_div_factor = final_div_factor
+
+    def __call__(self, t, num_iterations, iterations_per_epoch):
+        start = 1.0 / self.div_factor
+        end = start / self.final_div_factor
+        peak = max(int(self.pct_start * num_iterations), 1)
+        if t < peak:
+            progress = t / peak
+            lo, hi = start, 1.0
+        else:
+            progress = (t - peak) / max(num_iterations - 1 - peak, 1)
+            lo, hi = 1.0, end
+        return hi + (lo - hi) * 0.5 * (1 + math.cos(math.pi * min(progress, 1)))
+
+
+class WarmupSchedule(LRSchedule):
+    """
+    Ramps the learning rate up linearly from start_factor times its scheduled
+    value over the first warmup_epochs epochs, which keeps large learning
+    rates from diverging early on.
+
+    Inputs:
+    - schedule: The schedule to warm up; None for a constant learning rate.
+    - warmup_epochs: Length of the warmup, in epochs; may be fractional.
+    - start_factor: Factor of the first iteration.
+    """
+
+    def __init__(self, schedule=None, warmup_epochs=1.0, start_factor=0.0):
+        self.schedule = schedule or LRSchedule()
+        self.warmup_epochs = warmup_epochs
+        self.start_factor = start_factor
+
+    def __call__(self, t, num_iterations, iterations_per_epoch):
+        factor = self.schedule(t, num_iterations, iterations_per_epoch)
+        warmup = max(int(round(self.warmup_epochs * iterations_per_epoch)), 1)
+        if t < warmup:
+            factor *= (self.start_factor +
+                       (1 - self.start_factor) * (t + 1) / warmup)
+        return factor
+
+    def observe(self, val_acc):
+        self.schedule.observe(val_acc)
+
+    def state(self):
+        return self.schedule.state()
+
+    def load_state(self, state):
+        self.schedule.load_state(state)
+
+
+class PlateauSchedule(LRSchedule):
+    """
+    Multiplies the learning rate by factor whenever the validation accuracy
+    has not improved by more than threshold for more than patience accuracy
+    checks in a row.
+
+    Inputs:
+    - factor: Decay factor.
+    - patience: Number of accuracy checks without improvement to wait before
+      decaying.
+    - threshold: Smallest improvement of the validation accuracy that counts.
+    - min_factor: Lower bound of the learning rate factor.
+    """
+
+    def __init__(self, factor=0.1, patience=2, threshold=1e-4, min_factor=0.0):
+        self.factor = factor
+        self.patience = patience
+        self.threshold = threshold
+        self.min_factor = min_factor
+        self.scale = 1.0
+        self.best = None
+        self.num_bad = 0
+
+    def __call__(self, t, num_iterations, iterations_per_epoch):
+        return self.scale
+
+    def observe(self, val_acc):
+        if self.best is None or val_acc > self.best + self.threshold:
+            self.best = val_acc
+            self.num_bad = 0
+            return
+        self.num_bad += 1
+        if self.num_bad > self.patience:
+            self.scale = max(self.scale * self.factor, self.min_factor)
+            self.num_bad = 0
+
+    def state(self):
+        return {'scale': self.scale, 'best': self.best, 'num_bad': self.num_bad}
+
+    def load_state(self, state):
+        self.scale = state['scale']
+        self.best = state['best']
+        self.num_bad = state['num_bad']